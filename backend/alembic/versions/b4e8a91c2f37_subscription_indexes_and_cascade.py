@@ -0,0 +1,46 @@
+"""Subscription status indexes, drop redundant PK indexes, cascade deletes
+
+Revision ID: b4e8a91c2f37
+Revises: 7c1d2e9f4a10
+Create Date: 2026-10-17 11:03:52.640195
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4e8a91c2f37'
+down_revision: Union[str, None] = '7c1d2e9f4a10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The initial migration left the foreign key unnamed; this matches PostgreSQL's default name
+naming_convention = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
+def upgrade() -> None:
+    # Primary keys are already indexed
+    op.drop_index('ix_accounts_id', table_name='accounts')
+    op.drop_index('ix_subscriptions_id', table_name='subscriptions')
+
+    with op.batch_alter_table('subscriptions', naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint('subscriptions_account_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('subscriptions_account_id_fkey', 'accounts', ['account_id'], ['id'], ondelete='CASCADE')
+
+    op.create_index('ix_subscriptions_account_id_status', 'subscriptions', ['account_id', 'status'], unique=False)
+    op.create_index('ix_subscriptions_pending_account_id', 'subscriptions', ['account_id'], unique=False, postgresql_where=sa.text("status = 'pending'"), sqlite_where=sa.text("status = 'pending'"))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_subscriptions_pending_account_id', table_name='subscriptions')
+    op.drop_index('ix_subscriptions_account_id_status', table_name='subscriptions')
+
+    with op.batch_alter_table('subscriptions', naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint('subscriptions_account_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('subscriptions_account_id_fkey', 'accounts', ['account_id'], ['id'])
+
+    op.create_index('ix_subscriptions_id', 'subscriptions', ['id'], unique=False)
+    op.create_index('ix_accounts_id', 'accounts', ['id'], unique=False)
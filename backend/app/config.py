@@ -1,7 +1,15 @@
 import os
 from dotenv import load_dotenv
 
+_loaded = False
+
+
 def load_environment():
+    """Loads the .env files once per process; later calls do nothing."""
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
     load_dotenv()
 
     environment = os.getenv("ENVIRONMENT", "development")
@@ -1,8 +1,13 @@
 import os
-from sqlalchemy import create_engine
+from contextlib import asynccontextmanager, contextmanager
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import load_environment
+from app.db_pool import InstrumentedQueuePool, pool_stats
+from app.metrics import instrument_engine
 
 load_environment()
 
@@ -12,11 +17,149 @@ SQLALCHEMY_DATABASE_URL = os.getenv("ACCOUNTS_DATABASE", "postgresql+psycopg2://
 # Determine the connect arguments based on the database being used
 connect_args = {}
 
+# Connections all WEB_CONCURRENCY workers of one container may open together; 0 leaves
+# DB_POOL_SIZE / DB_MAX_OVERFLOW as they are, otherwise they are capped to each worker's share
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "0"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+def pool_sizes(pool_size, max_overflow, max_connections=0, workers=1):
+    """Returns ``(pool_size, max_overflow)`` for each of a worker's two engines.
+
+    A worker's share of ``max_connections`` keeps one connection for the
+    leader lock and is split evenly between the sync and async engines.
+    """
+    if not max_connections:
+        return pool_size, max_overflow
+    capacity = max((max_connections // max(workers, 1) - 1) // 2, 1)
+    size = min(pool_size, capacity)
+    return size, min(max_overflow, capacity - size)
+
+
+# Connection pool sizing; Pub/Sub callback threads are sized against DB_POOL_CAPACITY
+DB_POOL_SIZE, DB_MAX_OVERFLOW = pool_sizes(
+    int(os.getenv("DB_POOL_SIZE", "5")),
+    int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    DB_MAX_CONNECTIONS,
+    WEB_CONCURRENCY,
+)
+DB_POOL_CAPACITY = DB_POOL_SIZE + DB_MAX_OVERFLOW
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Replace connections older than this many seconds, before Cloud SQL drops them while idle
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Test connections on checkout so a dropped connection is replaced instead of failing the query
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+pool_args = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+# In-memory SQLite uses a per-thread pool that takes no sizing arguments
+if make_url(SQLALCHEMY_DATABASE_URL).database not in (None, "", ":memory:"):
+    pool_args.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+
 # Create the database engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **pool_args)
+pool_stats.attach(engine)
+instrument_engine(engine)
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite only enforces foreign keys (and ON DELETE CASCADE) when asked to
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", _enable_sqlite_foreign_keys)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Async engine for the HTTP routers, derived from ACCOUNTS_DATABASE unless set explicitly.
+# It has its own pool of the same size as the sync engine used by the Pub/Sub handlers.
+ASYNC_ACCOUNTS_DATABASE = os.getenv("ASYNC_ACCOUNTS_DATABASE")
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+# Created on first use so the sync-only Pub/Sub path never needs an async driver
+_async_engine = None
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+
+def async_database_url():
+    if ASYNC_ACCOUNTS_DATABASE:
+        return make_url(ASYNC_ACCOUNTS_DATABASE)
+    url = make_url(SQLALCHEMY_DATABASE_URL)
+    url = url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+    if "sslmode" in url.query:
+        # asyncpg calls psycopg2's sslmode parameter "ssl"
+        url = url.difference_update_query(["sslmode"]).update_query_dict(
+            {"ssl": url.query["sslmode"]}
+        )
+    return url
+
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        url = async_database_url()
+        args = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+        if url.database not in (None, "", ":memory:"):
+            args.update(
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+            )
+        _async_engine = create_async_engine(url, **args)
+        instrument_engine(_async_engine.sync_engine)
+        if _async_engine.dialect.name == "sqlite":
+            event.listen(
+                _async_engine.sync_engine, "connect", _enable_sqlite_foreign_keys
+            )
+    return _async_engine
+
+
+async def dispose_async_engine():
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+
+@contextmanager
+def transaction_scope(db):
+    """Unit of work: commits once if the block succeeds, rolls back if it raises."""
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+@asynccontextmanager
+async def async_transaction_scope(db):
+    """Async unit of work: commits once if the block succeeds, rolls back if it raises."""
+    try:
+        yield db
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+
+def upsert_insert(db, model):
+    """Returns an INSERT for ``model`` that supports ON CONFLICT on the session's dialect."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upserts are not supported on {dialect}")
+
+
 # Function to get a new database session
 def get_db():
     db = SessionLocal()
@@ -24,3 +167,9 @@ def get_db():
         yield db  # This is a synchronous generator function
     finally:
         db.close()
+
+
+# Async counterpart of get_db for the HTTP routers
+async def get_async_db():
+    async with AsyncSessionLocal(bind=get_async_engine()) as db:
+        yield db
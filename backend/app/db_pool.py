@@ -0,0 +1,91 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    """Connection pool counters fed by InstrumentedQueuePool and the engine's pool events."""
+
+    WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_seconds = 0.0
+        self.max_checkout_wait_seconds = 0.0
+        self.wait_buckets = [0] * (len(self.WAIT_BUCKETS_MS) + 1)
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+
+    def record_wait(self, seconds):
+        milliseconds = seconds * 1000
+        bucket = next(
+            (i for i, bound in enumerate(self.WAIT_BUCKETS_MS) if milliseconds <= bound),
+            len(self.WAIT_BUCKETS_MS),
+        )
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_seconds += seconds
+            self.max_checkout_wait_seconds = max(self.max_checkout_wait_seconds, seconds)
+            self.wait_buckets[bucket] += 1
+
+    def increment(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def attach(self, engine):
+        """Counts new, invalidated and soft-invalidated connections of ``engine``."""
+        event.listen(engine, "connect", lambda *args: self.increment("connects"))
+        event.listen(engine, "invalidate", lambda *args: self.increment("invalidations"))
+        event.listen(
+            engine, "soft_invalidate", lambda *args: self.increment("soft_invalidations")
+        )
+
+    def snapshot(self, pool):
+        with self._lock:
+            stats = {
+                "checkouts": self.checkouts,
+                "checkout_wait_seconds_total": self.checkout_wait_seconds,
+                "checkout_wait_seconds_max": self.max_checkout_wait_seconds,
+                "checkout_wait_ms_buckets": {
+                    **{
+                        f"le_{bound}": count
+                        for bound, count in zip(self.WAIT_BUCKETS_MS, self.wait_buckets)
+                    },
+                    "le_inf": self.wait_buckets[-1],
+                },
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+                timeout=pool.timeout(),
+            )
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.increment("timeouts")
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - started)
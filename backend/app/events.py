@@ -0,0 +1,123 @@
+"""Typed marketplace events.
+
+``decode_event`` parses and validates a Pub/Sub message body in a single
+pass of pydantic-core's compiled schema, picking the model from the
+``eventType``; event types without a model decode to ``UnknownEvent``.
+Malformed events raise ``InvalidEventError``, a ``ValueError``, so they
+are rejected before any handler runs.
+"""
+from datetime import datetime
+from typing import Annotated, Literal, Union
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
+from pydantic.alias_generators import to_camel
+
+
+class EventModel(BaseModel):
+    # Fields are snake_case in Python and camelCase on the wire; unknown fields are ignored
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True, frozen=True)
+
+
+class EntityRef(EventModel):
+    id: str = Field(min_length=1)
+
+
+class EntitlementRef(EntityRef):
+    new_plan: str | None = None
+
+
+class PlanChangeRef(EntitlementRef):
+    new_plan: str = Field(min_length=1)
+
+
+class Event(EventModel):
+    event_id: str | None = None
+    event_type: str
+
+    @property
+    def entity_id(self):
+        """The entitlement or account ID the event is about, if any."""
+        return None
+
+
+class AccountEvent(Event):
+    event_type: Literal["ACCOUNT_ACTIVE", "ACCOUNT_DELETED"]
+    account: EntityRef
+
+    @property
+    def entity_id(self):
+        return self.account.id
+
+
+class EntitlementEvent(Event):
+    event_type: Literal[
+        "ENTITLEMENT_CREATION_REQUESTED",
+        "ENTITLEMENT_OFFER_ACCEPTED",
+        "ENTITLEMENT_ACTIVE",
+        "ENTITLEMENT_CANCELLED",
+        "ENTITLEMENT_DELETED",
+        "ENTITLEMENT_PLAN_CHANGED",
+    ]
+    entitlement: EntitlementRef
+
+    @property
+    def entity_id(self):
+        return self.entitlement.id
+
+
+class PlanChangeRequestedEvent(EntitlementEvent):
+    event_type: Literal["ENTITLEMENT_PLAN_CHANGE_REQUESTED"]
+    entitlement: PlanChangeRef
+
+
+class UnknownEvent(Event):
+    """An eventType without a model; it is logged and acked without a handler."""
+
+    event_type: str = ""
+
+
+event_adapter = TypeAdapter(
+    Annotated[
+        Union[AccountEvent, EntitlementEvent, PlanChangeRequestedEvent],
+        Field(discriminator="event_type"),
+    ]
+)
+# Raised for an eventType without a model, or none at all
+UNKNOWN_EVENT_TYPE_ERRORS = {"union_tag_invalid", "union_tag_not_found"}
+
+
+class InvalidEventError(ValueError):
+    pass
+
+
+def decode_event(data):
+    """Decodes a JSON event (bytes or str) into its typed model."""
+    try:
+        try:
+            return event_adapter.validate_json(data)
+        except ValidationError as e:
+            errors = e.errors()
+            if len(errors) == 1 and errors[0]["type"] in UNKNOWN_EVENT_TYPE_ERRORS:
+                return UnknownEvent.model_validate_json(data)
+            raise
+    except ValidationError as e:
+        raise InvalidEventError(
+            "; ".join(
+                f"{'.'.join(map(str, error['loc'])) or 'event'}: {error['msg']}"
+                for error in e.errors()
+            )
+        ) from None
+
+
+class EntitlementDetails(EventModel):
+    """The Procurement API entitlement fields the handlers use."""
+
+    account: str
+    product: str | None = None
+    plan: str | None = None
+    usage_reporting_id: str | None = None
+    create_time: datetime
+
+    @property
+    def account_id(self):
+        return self.account.split("/")[-1]
@@ -0,0 +1,158 @@
+import asyncio
+import email.utils
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+from cryptography.x509 import load_pem_x509_certificate
+
+logger = logging.getLogger(__name__)
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class GoogleKeyCache:
+    """Caches Google's x509 signing keys, parsed and keyed by ``kid``.
+
+    Keys are kept until the response's Cache-Control/Expires lifetime runs
+    out and are refetched in a background timer shortly before that. An
+    unknown ``kid`` forces a refresh (rate limited by ``min_refresh_interval``)
+    and concurrent refreshes are collapsed into a single fetch.
+    """
+
+    def __init__(
+        self,
+        url,
+        refresh_margin=300,
+        default_max_age=3600,
+        min_refresh_interval=30,
+        retry_interval=60,
+        timeout=5.0,
+    ):
+        self.url = url
+        self.refresh_margin = refresh_margin
+        self.default_max_age = default_max_age
+        self.min_refresh_interval = min_refresh_interval
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._expires_at = 0.0
+        self._fetched_at = None
+        self._generation = 0
+        self._refresh_lock = threading.Lock()
+        self._async_refresh_lock = asyncio.Lock()
+        self._timer = None
+
+    async def get_key_async(self, kid, client):
+        """Returns the parsed public key for ``kid``, refreshing through the
+        given ``httpx.AsyncClient`` only when needed."""
+        key = self._cached_key(kid)
+        if key is None:
+            await self.refresh_async(client, self._generation)
+            key = self._keys.get(kid)
+        if key is None:
+            raise KeyError(kid)
+        return key
+
+    def refresh(self, seen_generation=None):
+        """Fetches the key set unless another thread already did since ``seen_generation``."""
+        with self._refresh_lock:
+            if seen_generation is not None and self._generation != seen_generation:
+                return
+            try:
+                response = httpx.get(self.url, timeout=self.timeout)
+                self._store(response)
+            except Exception as e:
+                self._fetch_failed(e)
+
+    async def refresh_async(self, client, seen_generation=None):
+        """Async refresh; concurrent callers on the event loop share one fetch."""
+        async with self._async_refresh_lock:
+            if seen_generation is not None and self._generation != seen_generation:
+                return
+            try:
+                response = await client.get(self.url, timeout=self.timeout)
+                self._store(response)
+            except Exception as e:
+                self._fetch_failed(e)
+
+    def _cached_key(self, kid):
+        """Returns a fresh cached key, or None if the key set must be refetched."""
+        key = self._keys.get(kid)
+        if key is not None and time.monotonic() < self._expires_at:
+            return key
+        if key is None and self._fetched_recently():
+            raise KeyError(kid)
+        return None
+
+    def _store(self, response):
+        response.raise_for_status()
+        keys = {
+            kid: load_pem_x509_certificate(pem.encode()).public_key()
+            for kid, pem in response.json().items()
+        }
+        max_age = self._max_age(response.headers)
+        self._keys = keys
+        self._expires_at = time.monotonic() + max_age
+        self._fetched_at = time.monotonic()
+        self._generation += 1
+        logger.info(f"Fetched {len(keys)} Google signing keys, valid for {max_age}s")
+        self._schedule_refresh(max(max_age - self.refresh_margin, self.min_refresh_interval))
+
+    def _fetch_failed(self, error):
+        if not self._keys:
+            raise error
+        # Keep serving the keys we already have rather than failing signups
+        logger.warning(f"Failed to refresh Google signing keys, keeping cached set: {error}")
+        self._expires_at = time.monotonic() + self.retry_interval
+        self._generation += 1
+        self._schedule_refresh(self.retry_interval)
+
+    def start(self):
+        """Fetches the key set in the background so the first request finds it cached."""
+        self._schedule_refresh(0)
+
+    def stop(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _fetched_recently(self):
+        return (
+            self._fetched_at is not None
+            and time.monotonic() - self._fetched_at < self.min_refresh_interval
+        )
+
+    def _schedule_refresh(self, delay):
+        self.stop()
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh(self._generation)
+        except Exception as e:
+            logger.error(f"Background refresh of Google signing keys failed: {e}")
+            self._schedule_refresh(self.retry_interval)
+
+    def _max_age(self, headers):
+        match = _MAX_AGE_RE.search(headers.get("cache-control", ""))
+        if match:
+            age = int(headers.get("age", "0") or 0)
+            return max(int(match.group(1)) - age, 0)
+
+        expires = headers.get("expires")
+        if expires:
+            try:
+                expires_at = email.utils.parsedate_to_datetime(expires)
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                return max((expires_at - datetime.now(timezone.utc)).total_seconds(), 0)
+            except (TypeError, ValueError):
+                pass
+
+        return self.default_max_age
@@ -0,0 +1,51 @@
+import importlib.util
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_HTTP_TIMEOUT = float(os.getenv("OUTBOUND_HTTP_TIMEOUT", "10"))
+OUTBOUND_HTTP_CONNECT_TIMEOUT = float(os.getenv("OUTBOUND_HTTP_CONNECT_TIMEOUT", "5"))
+OUTBOUND_HTTP_MAX_CONNECTIONS = int(os.getenv("OUTBOUND_HTTP_MAX_CONNECTIONS", "100"))
+OUTBOUND_HTTP_MAX_KEEPALIVE = int(os.getenv("OUTBOUND_HTTP_MAX_KEEPALIVE", "20"))
+# HTTP/2 is negotiated with servers that support it; h2 comes with the httpx[http2] extra
+OUTBOUND_HTTP2 = os.getenv("OUTBOUND_HTTP2", "true").lower() == "true"
+
+_client = None
+
+
+def create_http_client():
+    http2 = OUTBOUND_HTTP2 and importlib.util.find_spec("h2") is not None
+    if OUTBOUND_HTTP2 and not http2:
+        logger.info("h2 is not installed; outbound requests use HTTP/1.1")
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(OUTBOUND_HTTP_TIMEOUT, connect=OUTBOUND_HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=OUTBOUND_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=OUTBOUND_HTTP_MAX_KEEPALIVE,
+        ),
+    )
+
+
+async def start_http_client():
+    global _client
+    if _client is None:
+        _client = create_http_client()
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client():
+    """The shared AsyncClient, created on first use if the app has not started it."""
+    global _client
+    if _client is None:
+        _client = create_http_client()
+    return _client
@@ -0,0 +1,82 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from app.models import ProcessedEvent
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessedEventStore:
+    """Remembers which Pub/Sub messages have already been handled.
+
+    A message counts as processed when either its Pub/Sub ``message_id`` or
+    its marketplace ``eventId`` has been recorded. Lookups hit an in-memory
+    LRU first and fall back to the ``processed_events`` table, so a
+    redelivered message is skipped without calling the Procurement API.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen_recently(self, message_id, event_id=None):
+        """Checks the in-memory LRU only."""
+        with self._lock:
+            for key in self._keys(message_id, event_id):
+                if key in self._recent:
+                    self._recent.move_to_end(key)
+                    return True
+        return False
+
+    def seen(self, db, message_id, event_id=None):
+        if self.seen_recently(message_id, event_id):
+            return True
+
+        criteria = [ProcessedEvent.message_id == message_id]
+        if event_id:
+            criteria.append(ProcessedEvent.event_id == event_id)
+        found = db.query(ProcessedEvent.id).filter(or_(*criteria)).first() is not None
+        if found:
+            self.remember(message_id, event_id)
+        return found
+
+    def record(self, db, message_id, event_id=None, event_type=None):
+        """Adds the processed marker to ``db``; it is written by the caller's commit."""
+        db.add(
+            ProcessedEvent(
+                message_id=message_id, event_id=event_id, event_type=event_type
+            )
+        )
+
+    def remember(self, message_id, event_id=None):
+        """Adds a committed message to the LRU."""
+        with self._lock:
+            for key in self._keys(message_id, event_id):
+                self._recent[key] = True
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.max_entries:
+                self._recent.popitem(last=False)
+
+    def prune(self, db, retention_days):
+        """Deletes markers older than any message Pub/Sub could still redeliver."""
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        deleted = (
+            db.query(ProcessedEvent)
+            .filter(ProcessedEvent.processed_at < cutoff)
+            .delete(synchronize_session=False)
+        )
+        db.commit()
+        logger.info(f"Pruned {deleted} processed event markers older than {cutoff}")
+        return deleted
+
+    @staticmethod
+    def _keys(message_id, event_id):
+        keys = [("message", message_id)]
+        if event_id:
+            keys.append(("event", event_id))
+        return keys
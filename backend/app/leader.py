@@ -0,0 +1,197 @@
+import logging
+import os
+import tempfile
+import threading
+import zlib
+
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+# Only the process holding the lock runs the Pub/Sub subscriber
+LEADER_ELECTION_ENABLED = os.getenv("LEADER_ELECTION_ENABLED", "true").lower() == "true"
+LEADER_LOCK_ID = int(
+    os.getenv("LEADER_LOCK_ID", str(zlib.crc32(b"landgriffon:pubsub-subscriber")))
+)
+# SQLite stand-in; defaults to a file next to the database
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE")
+LEADER_RETRY_INTERVAL = float(os.getenv("LEADER_RETRY_INTERVAL", "15"))
+LEADER_HEARTBEAT_INTERVAL = float(os.getenv("LEADER_HEARTBEAT_INTERVAL", "10"))
+
+
+class AdvisoryLock:
+    """Session-level Postgres advisory lock on a dedicated connection.
+
+    The lock is released by Postgres when the connection or the process
+    dies, so a crashed leader is replaced after the next retry interval.
+    """
+
+    def __init__(self, url, key, connect_args=None):
+        self.key = key
+        # Outside the app's pool so the lock never holds one of its connections
+        self._engine = create_engine(url, poolclass=NullPool, connect_args=connect_args or {})
+        self._connection = None
+
+    def acquire(self):
+        connection = self._engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            acquired = connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}
+            ).scalar()
+        except Exception:
+            connection.close()
+            raise
+        if acquired:
+            self._connection = connection
+        else:
+            connection.close()
+        return acquired
+
+    def check(self):
+        """Returns False once the connection holding the lock is gone."""
+        try:
+            self._connection.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            logger.error(f"Leader lock connection failed: {e}")
+            return False
+
+    def release(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": self.key}
+            )
+        except Exception as e:
+            logger.warning(f"Failed to release leader lock: {e}")
+        finally:
+            self._connection.close()
+            self._connection = None
+
+
+class FileLock:
+    """flock-based stand-in for local runs on SQLite; one lock per host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        import fcntl
+
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def check(self):
+        return True
+
+    def release(self):
+        if self._file is not None:
+            import fcntl
+
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class LeaderElection:
+    """Keeps the work started by ``start_leader`` running in this process
+    only while it holds ``lock``.
+
+    ``start_leader`` starts the work and returns its thread. Followers retry
+    every ``retry_interval`` seconds. The leader checks the lock every
+    ``heartbeat_interval`` seconds and calls ``stop_leader`` once it is lost
+    or the thread exits, then competes for the lock again.
+    """
+
+    def __init__(self, lock, retry_interval=LEADER_RETRY_INTERVAL, heartbeat_interval=LEADER_HEARTBEAT_INTERVAL):
+        self.lock = lock
+        self.retry_interval = retry_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.is_leader = False
+        self._stopping = threading.Event()
+        self._thread = None
+        self._leader = None
+
+    def start(self, start_leader, stop_leader):
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(start_leader, stop_leader), daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, start_leader, stop_leader):
+        while not self._stopping.is_set():
+            try:
+                acquired = self.lock.acquire()
+            except Exception as e:
+                logger.error(f"Leader election failed: {e}")
+                acquired = False
+            if not acquired:
+                logger.debug("Another process is the subscriber leader")
+                self._stopping.wait(self.retry_interval)
+                continue
+
+            logger.info(f"Elected subscriber leader in process {os.getpid()}")
+            self.is_leader = True
+            try:
+                self._lead(start_leader)
+            except Exception as e:
+                logger.error(f"Subscriber leader failed, giving up leadership: {e}")
+            finally:
+                self._step_down(stop_leader)
+            if not self._stopping.is_set():
+                self._stopping.wait(self.retry_interval)
+
+    def _lead(self, start_leader):
+        self._leader = start_leader()
+        while not self._stopping.wait(self.heartbeat_interval):
+            if not self.lock.check():
+                logger.error("Lost the leader lock, stopping the subscriber")
+                return
+            if not self._leader.is_alive():
+                logger.warning("Subscriber exited, giving up leadership")
+                return
+
+    def _step_down(self, stop_leader):
+        """Stops the work and releases the lock, whatever ended the term."""
+        try:
+            stop_leader()
+            if self._leader is not None:
+                self._leader.join(self.heartbeat_interval)
+        except Exception as e:
+            logger.error(f"Failed to stop the subscriber: {e}")
+        finally:
+            self._leader = None
+            try:
+                self.lock.release()
+            except Exception as e:
+                logger.error(f"Failed to release leader lock: {e}")
+            self.is_leader = False
+
+
+def create_leader_lock(url, connect_args=None):
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        return AdvisoryLock(url, LEADER_LOCK_ID, connect_args)
+    path = LEADER_LOCK_FILE
+    if not path:
+        if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+            path = f"{url.database}.subscriber.lock"
+        else:
+            path = os.path.join(tempfile.gettempdir(), "landgriffon-subscriber.lock")
+    return FileLock(path)
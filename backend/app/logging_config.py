@@ -1,42 +1,167 @@
+import atexit
+import copy
+import json
 import logging
 import logging.config
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from pydantic import BaseModel
+
+from app.metrics import Counter, registry
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Payload logs are attached to LOG_PAYLOAD_SAMPLE_RATE of events and cut at LOG_PAYLOAD_MAX_CHARS
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+log_records_dropped = registry.register(
+    Counter(
+        "log_records_dropped_total",
+        "Log records dropped because the logging queue was full.",
+    )
+)
+
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+_listener = None
+_traceback_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the field names Cloud Logging picks up."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the listener thread, dropping them instead of
+    blocking the caller when the queue is full."""
+
+    def prepare(self, record):
+        """Resolves the message arguments and renders the traceback, which
+        must not outlive the caller's frames; the listener's formatter does
+        the rest. QueueHandler.prepare would format the whole record here."""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+def queue_handler():
+    return DroppingQueueHandler(log_queue)
+
 
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
-    "formatters": {
-        "default": {
-            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        },
-    },
     "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "default",
+        "queue": {
+            "()": queue_handler,
         },
     },
     "root": {
-        "handlers": ["console"],
-        "level": "INFO",
+        "handlers": ["queue"],
+        "level": LOG_LEVEL,
     },
     "loggers": {
         "uvicorn": {
-            "handlers": ["console"],
+            "handlers": ["queue"],
             "level": "INFO",
             "propagate": False,
         },
         "uvicorn.error": {
             "level": "ERROR",
-            "handlers": ["console"],
+            "handlers": ["queue"],
             "propagate": True,
         },
         "uvicorn.access": {
             "level": "INFO",
-            "handlers": ["console"],
+            "handlers": ["queue"],
             "propagate": False,
         },
     },
 }
 
+
 def setup_logging():
+    """Configures logging so that formatting and stream I/O run on a
+    QueueListener thread instead of the request and callback threads."""
+    global _listener
     logging.config.dictConfig(LOGGING_CONFIG)
+
+    console = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        console.setFormatter(JsonFormatter())
+    else:
+        console.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    if _listener is None:
+        atexit.register(stop_logging)
+    else:
+        _listener.stop()
+    _listener = QueueListener(log_queue, console)
+    _listener.start()
+
+
+def stop_logging():
+    """Flushes the queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def truncate_payload(payload):
+    """Renders a payload for logging, cut at LOG_PAYLOAD_MAX_CHARS. Models are
+    only serialized here, so callers can pass them without paying for it."""
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump_json(by_alias=True)
+    if isinstance(payload, bytes):
+        text = payload[: LOG_PAYLOAD_MAX_CHARS + 1].decode("utf-8", "replace")
+        size = len(payload)
+    else:
+        text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+        size = len(text)
+    if size > LOG_PAYLOAD_MAX_CHARS:
+        return f"{text[:LOG_PAYLOAD_MAX_CHARS]}... ({size} chars)"
+    return text
+
+
+def log_payload(logger, message, payload, level=logging.INFO):
+    """Logs ``message``, with the truncated payload appended for a
+    LOG_PAYLOAD_SAMPLE_RATE sample of calls."""
+    if not logger.isEnabledFor(level):
+        return
+    if LOG_PAYLOAD_SAMPLE_RATE >= 1 or random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        message = f"{message}: {truncate_payload(payload)}"
+    logger.log(level, message, stacklevel=2)
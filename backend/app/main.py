@@ -1,14 +1,25 @@
-from fastapi import FastAPI, Query, Request
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from app.routers.router import router
-from app.database import engine, Base
-from app.pubsub import subscribe_to_pubsub, stop_subscriber
+from app.startup import startup_timer
+
+with startup_timer.phase("import fastapi"):
+    from fastapi import FastAPI, Query, Request
+    from fastapi.staticfiles import StaticFiles
+    from fastapi.templating import Jinja2Templates
+with startup_timer.phase("import database"):
+    from app.database import engine, Base, connect_args, dispose_async_engine, SQLALCHEMY_DATABASE_URL
+with startup_timer.phase("import pubsub"):
+    from app.pubsub import start_subscriber, stop_subscriber
+with startup_timer.phase("import routers"):
+    from app.routers.router import router, google_keys, outbox_worker
+    from app.routers.push import (
+        router as push_router, oidc_keys, push_handler, PUBSUB_PUSH_AUDIENCE, PUBSUB_PUSH_SERVICE_ACCOUNT
+    )
+from app.http_client import close_http_client, start_http_client
+from app.leader import LEADER_ELECTION_ENABLED, LeaderElection, create_leader_lock
+from app.metrics import registry
 import os
 import logging
 from app.logging_config import setup_logging
 from app.config import load_environment
-import threading
 import faulthandler
 
 faulthandler.enable()
@@ -18,11 +29,33 @@ setup_logging()
 
 logger = logging.getLogger(__name__)
 
+# Streaming pull can be turned off when Pub/Sub pushes to /pubsub/push instead
+PUBSUB_PULL_ENABLED = os.getenv("PUBSUB_PULL_ENABLED", "true").lower() == "true"
+# The Docker image runs "alembic upgrade head" before starting; enable for local runs without migrations
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "false").lower() == "true"
+
 logger.info(f"Environment variables loaded: {os.getenv('ENVIRONMENT')}")
 logger.info(f"GOOGLE_CLOUD_PROJECT: {os.getenv('GOOGLE_CLOUD_PROJECT')}")
 logger.info(f"PUBSUB_SUBSCRIPTION: {os.getenv('PUBSUB_SUBSCRIPTION')}")
 
 
+leader_election = LeaderElection(create_leader_lock(SQLALCHEMY_DATABASE_URL, connect_args))
+
+
+def leader_gauges():
+    return [
+        (
+            "pubsub_subscriber_leader",
+            "1 if this process holds the leader lock and runs the Pub/Sub subscriber.",
+            {(): int(leader_election.is_leader)},
+            (),
+        )
+    ]
+
+
+registry.register_collector(leader_gauges)
+
+
 def create_database():
     Base.metadata.create_all(bind=engine)
 
@@ -32,23 +65,54 @@ app = FastAPI()
 
 @app.on_event("startup")
 def on_startup():
-    logger.info("Starting Pub/Sub subscriber...")
-    threading.Thread(
-        target=subscribe_to_pubsub, daemon=True
-    ).start()  # Start the subscriber in a daemon thread
-    create_database()
+    if PUBSUB_PULL_ENABLED and LEADER_ELECTION_ENABLED:
+        # Only the worker holding the leader lock pulls, the others serve HTTP
+        logger.info("Starting Pub/Sub subscriber leader election...")
+        leader_election.start(start_subscriber, stop_subscriber)
+    elif PUBSUB_PULL_ENABLED:
+        logger.info("Starting Pub/Sub subscriber...")
+        start_subscriber()
+    else:
+        logger.info("Pub/Sub pull is disabled, events are only received on /pubsub/push")
+    if DB_CREATE_ALL:
+        with startup_timer.phase("create tables"):
+            create_database()
+    google_keys.start()  # Warm the JWT signing key cache before the first signup
+    if PUBSUB_PUSH_AUDIENCE:
+        if not PUBSUB_PUSH_SERVICE_ACCOUNT:
+            logger.error("PUBSUB_PUSH_SERVICE_ACCOUNT is not set, /pubsub/push rejects every OIDC token")
+        oidc_keys.start()
 
 
 @app.on_event("shutdown")
 def on_shutdown():
     logger.info("Stopping Pub/Sub subscriber...")
+    leader_election.stop()
     stop_subscriber()
+    push_handler.stop()
+    google_keys.stop()
+    oidc_keys.stop()
+
+
+@app.on_event("startup")
+async def open_http_client():
+    await start_http_client()
+    outbox_worker.start()
+    startup_timer.report()
+
+
+@app.on_event("shutdown")
+async def close_async_resources():
+    await outbox_worker.stop()
+    await close_http_client()
+    await dispose_async_engine()
 
 
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 app.include_router(router)
+app.include_router(push_router)
 
 
 @app.get("/success")
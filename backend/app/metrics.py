@@ -0,0 +1,259 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LAG_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 21600, 86400)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(labels, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._values[labels] = (counts, total + value)
+
+    @contextmanager
+    def time(self, *labels):
+        """Observes the duration of the ``with`` block, even if it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - started)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    bucket_labels = _labels(self.labelnames, labels, [("le", _number(bound))])
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                label_text = _labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{label_text} {_number(total)}")
+                lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Holds metrics plus collectors that report gauges or counters at scrape time."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector, metric_type="gauge"):
+        """``collector()`` returns ``(name, help, {label_tuple: value}, labelnames)``
+        tuples, rendered as ``metric_type`` ("gauge" or "counter")."""
+        self._collectors.append((collector, metric_type))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector, metric_type in self._collectors:
+            for name, help, values, labelnames in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in values.items():
+                    lines.append(f"{name}{_labels(labelnames, labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_duration = registry.register(
+    Histogram(
+        "pubsub_handler_duration_seconds",
+        "Time spent handling a Pub/Sub event, by event type.",
+        ["event_type"],
+    )
+)
+messages_acked = registry.register(
+    Counter(
+        "pubsub_messages_acked_total",
+        "Pub/Sub messages acknowledged, by event type.",
+        ["event_type"],
+    )
+)
+messages_nacked = registry.register(
+    Counter(
+        "pubsub_messages_nacked_total",
+        "Pub/Sub messages nacked for redelivery after a transient failure, by event type.",
+        ["event_type"],
+    )
+)
+events_coalesced = registry.register(
+    Counter(
+        "pubsub_events_coalesced_total",
+        "Pub/Sub events acked without running their handler because a later "
+        "event for the same entitlement superseded them, by event type.",
+        ["event_type"],
+    )
+)
+batch_duration = registry.register(
+    Histogram(
+        "pubsub_batch_duration_seconds",
+        "Time spent applying a batch of Pub/Sub messages, including any fallback.",
+    )
+)
+batch_messages = registry.register(
+    Counter(
+        "pubsub_batch_messages_total",
+        "Pub/Sub messages taken in batches.",
+    )
+)
+batch_fallbacks = registry.register(
+    Counter(
+        "pubsub_batch_fallbacks_total",
+        "Batches whose failed message and the rest were processed one at a time.",
+    )
+)
+coalesce_groups = registry.register(
+    Counter(
+        "pubsub_coalesce_groups_total",
+        "Groups of Pub/Sub messages for one entitlement or account applied together.",
+    )
+)
+coalesce_messages = registry.register(
+    Counter(
+        "pubsub_coalesce_messages_total",
+        "Pub/Sub messages taken in coalescing groups.",
+    )
+)
+coalesce_fallbacks = registry.register(
+    Counter(
+        "pubsub_coalesce_fallbacks_total",
+        "Coalescing groups whose failed message and the rest were processed one at a time.",
+    )
+)
+handler_errors = registry.register(
+    Counter(
+        "pubsub_handler_errors_total",
+        "Pub/Sub events whose handler raised, by handler.",
+        ["handler"],
+    )
+)
+event_lag = registry.register(
+    Histogram(
+        "pubsub_event_lag_seconds",
+        "Time from Pub/Sub publish to ack, by event type.",
+        ["event_type"],
+        buckets=LAG_BUCKETS,
+    )
+)
+procurement_duration = registry.register(
+    Histogram(
+        "procurement_api_duration_seconds",
+        "Procurement API call latency, by method and outcome.",
+        ["method", "outcome"],
+    )
+)
+procurement_retries = registry.register(
+    Counter(
+        "procurement_api_retries_total",
+        "Procurement API calls retried after a transient failure, by method.",
+        ["method"],
+    )
+)
+db_query_duration = registry.register(
+    Histogram(
+        "db_query_duration_seconds",
+        "Database statement latency, by statement type.",
+        ["statement"],
+    )
+)
+signup_phase_duration = registry.register(
+    Histogram(
+        "signup_phase_duration_seconds",
+        "POST /signup latency, by phase (jwt, db).",
+        ["phase"],
+    )
+)
+
+outbox_task_duration = registry.register(
+    Histogram(
+        "outbox_task_duration_seconds",
+        "Outbox task run time, by kind and outcome.",
+        ["kind", "outcome"],
+    )
+)
+
+
+def instrument_engine(engine):
+    """Records every statement run on ``engine`` in db_query_duration."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        kind = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+        db_query_duration.observe(kind, value=time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, TIMESTAMP, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -6,7 +6,7 @@ from app.database import Base
 class Account(Base):
     __tablename__ = "accounts"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     procurement_account_id = Column(String, unique=True, index=True)
     internal_account_id = Column(String, unique=True, index=True)
     status = Column(String, default='pending')
@@ -15,13 +15,23 @@ class Account(Base):
     consumer_id = Column(String)
     created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now(), nullable=False)
-    subscriptions = relationship("Subscription", back_populates="account")
+    # Subscriptions are removed by the database's ON DELETE CASCADE
+    subscriptions = relationship("Subscription", back_populates="account", passive_deletes=True)
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        Index("ix_subscriptions_account_id_status", "account_id", "status"),
+        Index(
+            "ix_subscriptions_pending_account_id",
+            "account_id",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    account_id = Column(Integer, ForeignKey('accounts.id'))
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'))
     subscription_id = Column(String, unique=True, index=True)
     product_id = Column(String)
     plan_id = Column(String)
@@ -31,3 +41,43 @@ class Subscription(Base):
     created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now(), nullable=False)
     account = relationship("Account", back_populates="subscriptions")
+
+class ProcessedEvent(Base):
+    __tablename__ = "processed_events"
+
+    id = Column(Integer, primary_key=True)
+    message_id = Column(String, unique=True, nullable=False)
+    event_id = Column(String, index=True)
+    event_type = Column(String)
+    processed_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+
+class OutboxTask(Base):
+    __tablename__ = "outbox"
+    __table_args__ = (
+        Index("ix_outbox_status_available_at", "status", "available_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    aggregate_id = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    # Next time the task may run; while in progress, the end of the worker's lease
+    available_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    last_error = Column(String)
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+class DeadLetterEvent(Base):
+    __tablename__ = "dead_letter_events"
+
+    id = Column(Integer, primary_key=True)
+    message_id = Column(String, index=True)
+    event_id = Column(String, index=True)
+    event_type = Column(String)
+    # Raw message data, replayed as-is by app.replay
+    payload = Column(Text, nullable=False)
+    error = Column(Text)
+    replay_attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    replayed_at = Column(TIMESTAMP)
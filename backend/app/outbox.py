@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update
+
+from app.database import AsyncSessionLocal, async_transaction_scope, get_async_engine
+from app.metrics import outbox_task_duration
+from app.models import OutboxTask
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "4"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+# Retries wait OUTBOX_RETRY_DELAY seconds, doubling after every failed attempt
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", "5"))
+# Tasks left in progress longer than this (e.g. by a crashed worker) are picked up again
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+
+OPEN_STATUSES = ("pending", "in_progress")
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def enqueue_task(db, kind, aggregate_id):
+    """Adds a task to ``db`` unless one is already open; it is written by the caller's commit."""
+    existing = (
+        await db.execute(
+            select(OutboxTask.id)
+            .where(
+                OutboxTask.kind == kind,
+                OutboxTask.aggregate_id == aggregate_id,
+                OutboxTask.status.in_(OPEN_STATUSES),
+            )
+            .limit(1)
+        )
+    ).scalar()
+    if existing is None:
+        db.add(
+            OutboxTask(
+                kind=kind,
+                aggregate_id=aggregate_id,
+                status="pending",
+                attempts=0,
+                available_at=utcnow(),
+            )
+        )
+
+
+async def latest_task(db, kind, aggregate_id):
+    return (
+        await db.execute(
+            select(OutboxTask)
+            .where(OutboxTask.kind == kind, OutboxTask.aggregate_id == aggregate_id)
+            .order_by(OutboxTask.id.desc())
+            .limit(1)
+        )
+    ).scalar_one_or_none()
+
+
+class OutboxWorker:
+    """Drains the outbox on the event loop.
+
+    Tasks are claimed with a single UPDATE (``FOR UPDATE SKIP LOCKED`` on
+    PostgreSQL) so several app instances can share the table. Each claim
+    takes a lease of ``lease_seconds``; failed tasks are retried with
+    exponential backoff until ``max_attempts``, then marked failed.
+    ``handlers`` maps a task kind to ``async handler(aggregate_id, db)``.
+    """
+
+    def __init__(
+        self,
+        handlers,
+        concurrency=OUTBOX_CONCURRENCY,
+        poll_interval=OUTBOX_POLL_INTERVAL,
+        max_attempts=OUTBOX_MAX_ATTEMPTS,
+        retry_delay=OUTBOX_RETRY_DELAY,
+        lease_seconds=OUTBOX_LEASE_SECONDS,
+    ):
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self._inflight = set()
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, grace_period=10):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._inflight:
+            # Unfinished tasks are picked up again once their lease expires
+            await asyncio.wait(self._inflight, timeout=grace_period)
+            for task in self._inflight:
+                task.cancel()
+
+    def notify(self):
+        """Wakes the worker up so a new task does not wait for the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            slots = self.concurrency - len(self._inflight)
+            claimed = []
+            if slots > 0:
+                try:
+                    claimed = await self.claim(slots)
+                except Exception as e:
+                    logger.error(f"Failed to claim outbox tasks: {e}")
+            for row in claimed:
+                task = asyncio.create_task(self._process(*row))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+            if claimed and len(claimed) == slots:
+                # More tasks may be due, claim again as soon as a slot frees up
+                await asyncio.wait(self._inflight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            wakeup = asyncio.ensure_future(self._wakeup.wait())
+            await asyncio.wait(
+                {wakeup, *self._inflight},
+                timeout=self.poll_interval,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            wakeup.cancel()
+
+    async def claim(self, limit):
+        """Marks up to ``limit`` due tasks in progress and returns them."""
+        now = utcnow()
+        due = (
+            select(OutboxTask.id)
+            .where(
+                OutboxTask.status.in_(OPEN_STATUSES),
+                OutboxTask.available_at <= now,
+            )
+            .order_by(OutboxTask.available_at)
+            .limit(limit)
+        )
+        if get_async_engine().dialect.name == "postgresql":
+            due = due.with_for_update(skip_locked=True)
+        statement = (
+            update(OutboxTask)
+            .where(OutboxTask.id.in_(due))
+            .values(
+                status="in_progress",
+                attempts=OutboxTask.attempts + 1,
+                available_at=now + timedelta(seconds=self.lease_seconds),
+                updated_at=now,
+            )
+            .returning(
+                OutboxTask.id, OutboxTask.kind, OutboxTask.aggregate_id, OutboxTask.attempts
+            )
+            .execution_options(synchronize_session=False)
+        )
+        async with AsyncSessionLocal(bind=get_async_engine()) as db:
+            async with async_transaction_scope(db):
+                return (await db.execute(statement)).all()
+
+    async def _process(self, task_id, kind, aggregate_id, attempts):
+        started = time.perf_counter()
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise LookupError(f"No outbox handler for {kind}")
+            async with AsyncSessionLocal(bind=get_async_engine()) as db:
+                await handler(aggregate_id, db)
+        except Exception as e:
+            outbox_task_duration.observe(kind, "error", value=time.perf_counter() - started)
+            await self._failed(task_id, kind, aggregate_id, attempts, e)
+        else:
+            outbox_task_duration.observe(kind, "ok", value=time.perf_counter() - started)
+            await self._update(task_id, status="done", last_error=None)
+            logger.info(f"Outbox task {kind} for {aggregate_id} done")
+
+    async def _failed(self, task_id, kind, aggregate_id, attempts, error):
+        if attempts >= self.max_attempts or kind not in self.handlers:
+            logger.error(
+                f"Outbox task {kind} for {aggregate_id} failed after {attempts} attempts: {error}"
+            )
+            await self._update(task_id, status="failed", last_error=str(error))
+            return
+
+        delay = self.retry_delay * 2 ** (attempts - 1)
+        logger.warning(
+            f"Outbox task {kind} for {aggregate_id} failed (attempt {attempts}), "
+            f"retrying in {delay:g}s: {error}"
+        )
+        await self._update(
+            task_id,
+            status="pending",
+            last_error=str(error),
+            available_at=utcnow() + timedelta(seconds=delay),
+        )
+
+    async def _update(self, task_id, **values):
+        try:
+            async with AsyncSessionLocal(bind=get_async_engine()) as db:
+                async with async_transaction_scope(db):
+                    await db.execute(
+                        update(OutboxTask)
+                        .where(OutboxTask.id == task_id)
+                        .values(updated_at=utcnow(), **values)
+                    )
+        except Exception as e:
+            logger.error(f"Failed to update outbox task {task_id}: {e}")
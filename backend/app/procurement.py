@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import google.auth
+import google.auth.transport.requests
+import google_auth_httplib2
+import httplib2
+from googleapiclient.discovery import build_from_document
+
+from app.http_client import get_http_client
+from app.metrics import procurement_duration, procurement_retries
+from app.retry import CircuitBreaker, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+DEFAULT_BASE_URL = "https://cloudcommerceprocurement.googleapis.com/"
+# Bundled so building a client never fetches the discovery document over the network
+DISCOVERY_DOCUMENT_PATH = os.path.join(
+    os.path.dirname(__file__), "discovery", "cloudcommerceprocurement.v1.json"
+)
+
+_discovery_document = None
+
+
+def discovery_document():
+    """The bundled discovery document, read from disk once."""
+    global _discovery_document
+    if _discovery_document is None:
+        with open(DISCOVERY_DOCUMENT_PATH) as f:
+            _discovery_document = f.read()
+    return _discovery_document
+
+
+class ProcurementClient:
+    """Thread-safe client for the Cloud Commerce Partner Procurement API.
+
+    A discovery ``service`` shares one httplib2 transport, which is not
+    thread-safe, so every thread gets its own service and its own
+    keep-alive transport. ``max_concurrency`` bounds the calls in flight
+    across all threads. Pointing ``base_url`` at a local fake skips
+    authentication.
+
+    The ``*_async`` methods call the same REST endpoints through the shared
+    ``httpx.AsyncClient`` so request handlers can await them without
+    holding a thread; they are bounded by their own ``max_concurrency``
+    semaphore on the event loop.
+
+    Transient failures (429, 5xx, timeouts) are retried according to
+    ``retry_policy``, and ``breaker`` makes calls fail fast with
+    CircuitOpenError while the API is down. Backoff sleeps do not hold a
+    concurrency slot.
+    """
+
+    def __init__(
+        self,
+        project_id,
+        api_key=None,
+        base_url=None,
+        timeout=30,
+        max_concurrency=10,
+        credentials=None,
+        retry_policy=None,
+        breaker=None,
+    ):
+        self.project_id = project_id
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self._credentials = credentials
+        self._credentials_lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_semaphore = asyncio.Semaphore(max_concurrency)
+        self._token_lock = asyncio.Lock()
+        self._local = threading.local()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+
+    def fetch_entitlement_details(self, entitlement_id):
+        """Fetches the details of an entitlement."""
+        name = f"providers/{self.project_id}/entitlements/{entitlement_id}"
+        request = self.service.providers().entitlements().get(name=name)
+        return self._execute(request, "fetch_entitlement_details")
+
+    def approve_entitlement_plan_change(self, entitlement_id, new_plan):
+        """Approves the entitlement plan change in the Procurement Service."""
+        name = f"providers/{self.project_id}/entitlements/{entitlement_id}"
+        request = (
+            self.service.providers()
+            .entitlements()
+            .approvePlanChange(name=name, body={"pendingPlanName": new_plan})
+        )
+        return self._execute(request, "approve_entitlement_plan_change")
+
+    async def approve_account_async(self, procurement_account_id):
+        name = f"providers/{self.project_id}/accounts/{procurement_account_id}"
+        return await self._request_async(
+            "POST", f"{name}:approve", {"approvalName": "signup"}, "approve_account"
+        )
+
+    async def fetch_account_async(self, procurement_account_id):
+        name = f"providers/{self.project_id}/accounts/{procurement_account_id}"
+        return await self._request_async("GET", name, operation="fetch_account")
+
+    async def approve_entitlement_async(self, entitlement_id):
+        name = f"providers/{self.project_id}/entitlements/{entitlement_id}"
+        return await self._request_async(
+            "POST", f"{name}:approve", {}, "approve_entitlement"
+        )
+
+    async def fetch_entitlement_details_async(self, entitlement_id):
+        name = f"providers/{self.project_id}/entitlements/{entitlement_id}"
+        return await self._request_async(
+            "GET", name, operation="fetch_entitlement_details"
+        )
+
+    @property
+    def service(self):
+        """The calling thread's discovery service, built on first use."""
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._build_service()
+            self._local.service = service
+        return service
+
+    def _execute(self, request, operation):
+        attempt = 0
+        while True:
+            try:
+                return self._execute_once(request, operation)
+            except Exception as e:
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                delay = self._retry_delay(e, attempt, operation)
+            time.sleep(delay)
+            attempt += 1
+
+    def _execute_once(self, request, operation):
+        trial = self.breaker.before_call()
+        try:
+            with self._semaphore:
+                started = time.perf_counter()
+                try:
+                    response = request.execute()
+                except Exception as e:
+                    self._record(operation, started, e)
+                    raise
+                self._record(operation, started)
+                return response
+        except (KeyboardInterrupt, SystemExit):
+            if trial:
+                self.breaker.cancel()
+            raise
+
+    async def _request_async(self, method, path, body=None, operation=None):
+        url = f"{(self.base_url or DEFAULT_BASE_URL).rstrip('/')}/v1/{path}"
+        params = {"key": self.api_key} if self.api_key else None
+        operation = operation or method
+        attempt = 0
+        while True:
+            try:
+                return await self._request_once_async(
+                    method, url, body, params, operation
+                )
+            except Exception as e:
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                delay = self._retry_delay(e, attempt, operation)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _request_once_async(self, method, url, body, params, operation):
+        headers = await self._auth_headers()
+        trial = self.breaker.before_call()
+        try:
+            async with self._async_semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await get_http_client().request(
+                        method,
+                        url,
+                        json=body,
+                        params=params,
+                        headers=headers,
+                        timeout=self.timeout,
+                    )
+                    response.raise_for_status()
+                except Exception as e:
+                    self._record(operation, started, e)
+                    raise
+                self._record(operation, started)
+        except (asyncio.CancelledError, KeyboardInterrupt, SystemExit):
+            # Cancelled while waiting for a slot or for the response
+            if trial:
+                self.breaker.cancel()
+            raise
+        return response.json()
+
+    def _record(self, operation, started, error=None):
+        self.breaker.record(error)
+        procurement_duration.observe(
+            operation,
+            "ok" if error is None else "error",
+            value=time.perf_counter() - started,
+        )
+
+    def _retry_delay(self, error, attempt, operation):
+        delay = self.retry_policy.delay(error, attempt)
+        procurement_retries.inc(operation)
+        logger.warning(
+            f"Procurement API {operation} failed (attempt {attempt + 1}), "
+            f"retrying in {delay:.2f}s: {error}"
+        )
+        return delay
+
+    async def _auth_headers(self):
+        if self.base_url:
+            return {}
+        # google.auth.default() may read files or the metadata server, so only the first call is offloaded
+        credentials = self._credentials or await asyncio.to_thread(self._get_credentials)
+        if not credentials.valid:
+            async with self._token_lock:
+                if not credentials.valid:
+                    # Token refreshes are rare and use google-auth's blocking transport
+                    await asyncio.to_thread(
+                        credentials.refresh, google.auth.transport.requests.Request()
+                    )
+        return {"Authorization": f"Bearer {credentials.token}"}
+
+    def _build_service(self):
+        logger.debug(
+            f"Building Procurement API client for {threading.current_thread().name}"
+        )
+        client_options = {"api_endpoint": self.base_url} if self.base_url else None
+        return build_from_document(
+            discovery_document(),
+            http=self._http(),
+            developerKey=self.api_key,
+            client_options=client_options,
+        )
+
+    def _http(self):
+        http = httplib2.Http(timeout=self.timeout)
+        if self.base_url:
+            return http
+        return google_auth_httplib2.AuthorizedHttp(self._get_credentials(), http=http)
+
+    def _get_credentials(self):
+        with self._credentials_lock:
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=SCOPES)
+            return self._credentials
@@ -1,12 +1,38 @@
-import json
+import asyncio
 import os
+import queue
+import threading
+import time
 import uuid
-from datetime import datetime
-from google.cloud import pubsub_v1
-from googleapiclient.discovery import build
-from app.database import SessionLocal
-from app.models import Account, Subscription
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import joinedload
+from app.database import DB_POOL_CAPACITY, SessionLocal, transaction_scope, upsert_insert
+from app.events import EntitlementDetails, decode_event
+from app.models import Account, DeadLetterEvent, Subscription
 from app.config import load_environment
+from app.cache import TTLCache
+from app.idempotency import ProcessedEventStore
+from app.logging_config import log_payload, truncate_payload
+from app.metrics import (
+    batch_duration,
+    batch_fallbacks,
+    batch_messages,
+    coalesce_fallbacks,
+    coalesce_groups,
+    coalesce_messages,
+    event_lag,
+    events_coalesced,
+    handler_duration,
+    handler_errors,
+    messages_acked,
+    messages_nacked,
+)
+from app.procurement import ProcurementClient
+from app.retry import CircuitBreaker, RetryPolicy, is_transient
 import logging
 
 load_environment()
@@ -16,10 +42,67 @@ logger = logging.getLogger(__name__)
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
 PUBSUB_SUBSCRIPTION = os.getenv("PUBSUB_SUBSCRIPTION")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-service = build("cloudcommerceprocurement", "v1", developerKey=GOOGLE_API_KEY)
-
-_running = False
+# Override to point the Procurement API client at a local fake
+PROCUREMENT_API_BASE_URL = os.getenv("PROCUREMENT_API_BASE_URL")
+PROCUREMENT_API_TIMEOUT = float(os.getenv("PROCUREMENT_API_TIMEOUT", "30"))
+# Entitlement details are cached for ENTITLEMENT_CACHE_TTL seconds
+ENTITLEMENT_CACHE_TTL = float(os.getenv("ENTITLEMENT_CACHE_TTL", "60"))
+ENTITLEMENT_CACHE_SIZE = int(os.getenv("ENTITLEMENT_CACHE_SIZE", "1000"))
+# Parallel entitlement approvals per account in approve_entitlements_async
+ENTITLEMENT_APPROVAL_CONCURRENCY = int(os.getenv("ENTITLEMENT_APPROVAL_CONCURRENCY", "8"))
+# Batch mode is enabled when PUBSUB_BATCH_SIZE is greater than 1
+PUBSUB_BATCH_SIZE = int(os.getenv("PUBSUB_BATCH_SIZE", "1"))
+PUBSUB_BATCH_MAX_WAIT_MS = int(os.getenv("PUBSUB_BATCH_MAX_WAIT_MS", "200"))
+# Subscriber flow control; PUBSUB_CALLBACK_THREADS=0 sizes the executor automatically
+PUBSUB_MAX_MESSAGES = int(os.getenv("PUBSUB_MAX_MESSAGES", "100"))
+PUBSUB_MAX_BYTES = int(os.getenv("PUBSUB_MAX_BYTES", str(10 * 1024 * 1024)))
+PUBSUB_CALLBACK_THREADS = int(os.getenv("PUBSUB_CALLBACK_THREADS", "0"))
+# Events for one entitlement arriving within this window are applied together; 0 disables
+PUBSUB_COALESCE_WINDOW_MS = int(os.getenv("PUBSUB_COALESCE_WINDOW_MS", "0"))
+# Number of ordered worker lanes events are partitioned into; 0 disables partitioning
+PUBSUB_PARTITION_LANES = int(os.getenv("PUBSUB_PARTITION_LANES", "0"))
+# Lanes retry a transient failure in place, backing off up to the max delay, instead of nacking it
+PUBSUB_LANE_RETRY_BASE_DELAY = float(os.getenv("PUBSUB_LANE_RETRY_BASE_DELAY", "1"))
+PUBSUB_LANE_RETRY_MAX_DELAY = float(os.getenv("PUBSUB_LANE_RETRY_MAX_DELAY", "60"))
+# Redelivered messages are recognised by message_id or eventId
+PROCESSED_EVENTS_CACHE_SIZE = int(os.getenv("PROCESSED_EVENTS_CACHE_SIZE", "10000"))
+PROCESSED_EVENTS_RETENTION_DAYS = int(os.getenv("PROCESSED_EVENTS_RETENTION_DAYS", "8"))
+PROCUREMENT_MAX_CONCURRENCY = int(os.getenv("PROCUREMENT_MAX_CONCURRENCY", "10"))
+# Transient Procurement API failures are retried with exponential backoff
+PROCUREMENT_RETRY_ATTEMPTS = int(os.getenv("PROCUREMENT_RETRY_ATTEMPTS", "4"))
+PROCUREMENT_RETRY_BASE_DELAY = float(os.getenv("PROCUREMENT_RETRY_BASE_DELAY", "0.5"))
+PROCUREMENT_RETRY_MAX_DELAY = float(os.getenv("PROCUREMENT_RETRY_MAX_DELAY", "10"))
+# Consecutive transient failures that open the circuit, and seconds before a trial call
+PROCUREMENT_BREAKER_FAILURES = int(os.getenv("PROCUREMENT_BREAKER_FAILURES", "5"))
+PROCUREMENT_BREAKER_RESET = float(os.getenv("PROCUREMENT_BREAKER_RESET", "30"))
+
+_subscription = None
+_sink = None
+_subscriber_lock = threading.Lock()
+_stop_requested = threading.Event()
+
+processed_events = ProcessedEventStore(PROCESSED_EVENTS_CACHE_SIZE)
+
+entitlement_cache = TTLCache(ENTITLEMENT_CACHE_SIZE, ENTITLEMENT_CACHE_TTL)
+
+# Events after which cached entitlement details are stale
+ENTITLEMENT_CACHE_INVALIDATING_EVENTS = {
+    "ENTITLEMENT_PLAN_CHANGED",
+    "ENTITLEMENT_CANCELLED",
+    "ENTITLEMENT_DELETED",
+}
+
+procurement = ProcurementClient(
+    PROJECT_ID,
+    api_key=GOOGLE_API_KEY,
+    base_url=PROCUREMENT_API_BASE_URL,
+    timeout=PROCUREMENT_API_TIMEOUT,
+    max_concurrency=PROCUREMENT_MAX_CONCURRENCY,
+    retry_policy=RetryPolicy(
+        PROCUREMENT_RETRY_ATTEMPTS, PROCUREMENT_RETRY_BASE_DELAY, PROCUREMENT_RETRY_MAX_DELAY
+    ),
+    breaker=CircuitBreaker(PROCUREMENT_BREAKER_FAILURES, PROCUREMENT_BREAKER_RESET),
+)
 
 
 def _generate_internal_account_id():
@@ -27,440 +110,1064 @@ def _generate_internal_account_id():
     return str(uuid.uuid4())
 
 
-def approve_account(procurement_account_id):
-    """Approves the account in the Procurement Service."""
-    name = f"providers/{PROJECT_ID}/accounts/{procurement_account_id}"
-    request = (
-        service.providers()
-        .accounts()
-        .approve(name=name, body={"approvalName": "signup"})
+def signup_approved(account):
+    """True if a Procurement API account resource has its signup approved."""
+    return account.get("state") == "ACCOUNT_ACTIVE" or any(
+        approval.get("name") == "signup" and approval.get("state") == "APPROVED"
+        for approval in account.get("approvals", [])
     )
-    request.execute()
 
 
-def approve_entitlement(entitlement_id):
-    """Approves the entitlement in the Procurement Service."""
-    name = f"providers/{PROJECT_ID}/entitlements/{entitlement_id}"
-    request = service.providers().entitlements().approve(name=name, body={})
-    request.execute()
+def fetch_entitlement_details(entitlement_id):
+    """Fetches the details of an entitlement, served from entitlement_cache when fresh."""
+    return entitlement_cache.get_or_load(
+        entitlement_id,
+        lambda entitlement_id: EntitlementDetails.model_validate(
+            procurement.fetch_entitlement_details(entitlement_id)
+        ),
+    )
 
 
-def fetch_entitlement_details(entitlement_id):
-    """Fetches the details of an entitlement."""
-    name = f"providers/{PROJECT_ID}/entitlements/{entitlement_id}"
-    request = service.providers().entitlements().get(name=name)
-    response = request.execute()
-    return response
+def account_upsert_statement(db, procurement_account_id):
+    """INSERT ... ON CONFLICT DO NOTHING RETURNING id for a new pending account.
 
+    Works with both sync and async sessions; the ID is None if the account existed.
+    """
+    return (
+        upsert_insert(db, Account)
+        .values(
+            procurement_account_id=procurement_account_id,
+            internal_account_id=_generate_internal_account_id(),
+            status="pending",
+        )
+        .on_conflict_do_nothing(index_elements=[Account.procurement_account_id])
+        .returning(Account.id)
+    )
 
-def handle_account_active(payload, db):
-    logger.info("Handling ACCOUNT_ACTIVE event")
-    account_details = payload.get("account", {})
-    logger.info(f"Account details from payload: {account_details}")
 
-    procurement_account_id = account_details.get("id")
-    logger.info(f"Procurement account ID: {procurement_account_id}")
+async def approve_account_async(procurement_account_id):
+    """Approves the account; an account whose signup is already approved,
+    e.g. by an attempt whose local commit failed, counts as approved."""
+    try:
+        await procurement.approve_account_async(procurement_account_id)
+    except Exception as e:
+        if is_transient(e):
+            raise
+        try:
+            approved = signup_approved(
+                await procurement.fetch_account_async(procurement_account_id)
+            )
+        except Exception:
+            approved = False
+        if not approved:
+            raise
+        logger.info(f"Account already approved: {procurement_account_id}")
 
-    if not procurement_account_id:
-        logger.error("No procurement account ID found in the message.")
-        return
 
-    internal_account_id = _generate_internal_account_id()
-    logger.info(f"Generated internal account ID: {internal_account_id}")
+async def approve_entitlement_async(entitlement_id):
+    await procurement.approve_entitlement_async(entitlement_id)
 
-    try:
-        db_account = (
-            db.query(Account)
-            .filter(Account.procurement_account_id == procurement_account_id)
-            .first()
+
+async def fetch_entitlement_details_async(entitlement_id):
+    """Async fetch_entitlement_details sharing the same entitlement_cache."""
+    sentinel = object()
+    details = entitlement_cache.get(entitlement_id, sentinel)
+    if details is sentinel:
+        details = EntitlementDetails.model_validate(
+            await procurement.fetch_entitlement_details_async(entitlement_id)
         )
-        logger.info(f"Database account query result: {db_account}")
+        entitlement_cache.set(entitlement_id, details)
+    return details
 
-        if not db_account:
-            db_account = Account(
-                procurement_account_id=procurement_account_id,
-                internal_account_id=internal_account_id,
-                status="pending",
-            )
-            db.add(db_account)
-            db.commit()
-            logger.info(f"Account created and committed: {procurement_account_id}")
-        else:
-            logger.info(f"Account already exists: {procurement_account_id}")
-    except Exception as e:
-        logger.error(f"Error handling ACCOUNT_ACTIVE event: {e}")
 
+def upsert_account(db, procurement_account_id):
+    """Creates a pending account unless one exists, in a single statement.
 
-def handle_entitlement_event(payload, db):
-    logger.info("Handling ENTITLEMENT_CREATION_REQUESTED event")
+    Returns the new account's ID, or None if the account already existed.
+    """
+    return db.execute(account_upsert_statement(db, procurement_account_id)).scalar()
 
-    try:
-        entitlement = payload.get("entitlement", {})
-        subscription_id = entitlement.get("id")
-        if not subscription_id:
-            logger.error("No subscription ID found in the message.")
-            return
 
-        logger.info(f"Fetching details for subscription ID: {subscription_id}")
+def upsert_subscription(db, subscription_id, account_id, **fields):
+    """Inserts or updates a pending subscription in a single statement.
 
-        # Fetch the entitlement details to get the associated account ID and plan details
-        entitlement_details = fetch_entitlement_details(subscription_id)
-        logger.info(f"Entitlement details: {entitlement_details}")
-
-        procurement_account_id = entitlement_details.get("account").split("/")[-1]
-        product_id = entitlement_details.get("product")
-        plan_id = entitlement_details.get("plan")
-        consumer_id = entitlement_details.get("usageReportingId")
-        start_time = entitlement_details.get("createTime")
+    An existing account link is kept when ``account_id`` is None.
+    """
+    statement = upsert_insert(db, Subscription).values(
+        subscription_id=subscription_id,
+        account_id=account_id,
+        status="pending",
+        **fields,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[Subscription.subscription_id],
+        set_={
+            **{name: statement.excluded[name] for name in fields},
+            "status": statement.excluded.status,
+            "account_id": func.coalesce(
+                statement.excluded.account_id, Subscription.account_id
+            ),
+            # onupdate defaults are not applied to ON CONFLICT updates
+            "updated_at": func.now(),
+        },
+    ).returning(Subscription.id)
+    return db.execute(statement).scalar()
+
+
+def handle_account_active(event, db):
+    logger.info("Handling ACCOUNT_ACTIVE event")
+    procurement_account_id = event.account.id
+    logger.info(f"Procurement account ID: {procurement_account_id}")
 
-        start_time = datetime.fromisoformat(start_time.replace("Z", "+00:00"))
+    if upsert_account(db, procurement_account_id):
+        logger.info(f"Account created: {procurement_account_id}")
+    else:
+        logger.info(f"Account already exists: {procurement_account_id}")
 
-        logger.info(f"Procurement account ID: {procurement_account_id}")
 
-        db_account = (
-            db.query(Account)
-            .filter(Account.procurement_account_id == procurement_account_id)
-            .first()
-        )
+def handle_entitlement_event(event, db):
+    logger.info("Handling ENTITLEMENT_CREATION_REQUESTED event")
 
-        logger.info(f"Database account query result: {db_account}")
+    subscription_id = event.entitlement.id
+    logger.info(f"Fetching details for subscription ID: {subscription_id}")
 
-        if db_account:
-            db_subscription = (
-                db.query(Subscription)
-                .filter(Subscription.subscription_id == subscription_id)
-                .first()
-            )
-            if not db_subscription:
-                db_subscription = Subscription(
-                    account_id=db_account.id,
-                    subscription_id=subscription_id,
-                    product_id=product_id,
-                    plan_id=plan_id,
-                    consumer_id=consumer_id,
-                    start_time=start_time,
-                    status="pending",
-                )
-                db.add(db_subscription)
-                logger.info(f"New subscription created: {db_subscription}")
-            else:
-                db_subscription.product_id = product_id
-                db_subscription.plan_id = plan_id
-                db_subscription.consumer_id = consumer_id
-                db_subscription.start_time = start_time
-                db_subscription.status = "pending"
-                logger.info(f"Updated existing subscription: {db_subscription}")
-
-            db_account.plan_id = plan_id
-            db_account.start_time = start_time
-            db_account.consumer_id = consumer_id
-            db.commit()
-            logger.info(f"Entitlement creation requested: {subscription_id}")
-        else:
-            # Store the entitlement with a reference to the account but don't approve it yet
-            db_subscription = Subscription(
-                subscription_id=subscription_id,
-                product_id=product_id,
-                plan_id=plan_id,
-                consumer_id=consumer_id,
-                start_time=start_time,
-                status="pending",
-            )
-            db.add(db_subscription)
-            db.commit()
-            logger.info(f"Entitlement stored for later approval: {subscription_id}")
-    except Exception as e:
-        logger.error(f"Failed to handle ENTITLEMENT_CREATION_REQUESTED event: {e}")
-        db.rollback()
+    # Fetch the entitlement details to get the associated account ID and plan details
+    entitlement_details = fetch_entitlement_details(subscription_id)
+    log_payload(logger, "Entitlement details", entitlement_details)
 
+    procurement_account_id = entitlement_details.account_id
+    product_id = entitlement_details.product
+    plan_id = entitlement_details.plan
+    consumer_id = entitlement_details.usage_reporting_id
+    start_time = entitlement_details.create_time
 
-def handle_entitlement_active(payload, db):
-    entitlement = payload.get("entitlement", {})
-    subscription_id = entitlement.get("id")
-    if not subscription_id:
-        logger.error("No subscription ID found in the message.")
-        return
+    logger.info(f"Procurement account ID: {procurement_account_id}")
 
-    db_subscription = (
-        db.query(Subscription)
-        .filter(Subscription.subscription_id == subscription_id)
-        .first()
+    # Update the account's plan and look up its ID in one round trip
+    account_id = db.execute(
+        update(Account)
+        .where(Account.procurement_account_id == procurement_account_id)
+        .values(plan_id=plan_id, start_time=start_time, consumer_id=consumer_id)
+        .returning(Account.id)
+    ).scalar()
+
+    # Without an account the entitlement is stored for later approval
+    upsert_subscription(
+        db,
+        subscription_id,
+        account_id,
+        product_id=product_id,
+        plan_id=plan_id,
+        consumer_id=consumer_id,
+        start_time=start_time,
     )
+    if account_id:
+        logger.info(f"Entitlement creation requested: {subscription_id}")
+    else:
+        logger.info(f"Entitlement stored for later approval: {subscription_id}")
+
+
+def get_subscription(db, subscription_id, with_account=False):
+    """Loads a subscription, optionally with its account in the same query."""
+    query = db.query(Subscription)
+    if with_account:
+        query = query.options(joinedload(Subscription.account))
+    return query.filter(Subscription.subscription_id == subscription_id).first()
+
+
+def handle_entitlement_active(event, db):
+    subscription_id = event.entitlement.id
+
+    db_subscription = get_subscription(db, subscription_id)
     if db_subscription:
         db_subscription.status = "active"
-        db.commit()
         logger.info(f"Entitlement activated: {subscription_id}")
     else:
         logger.error(f"No subscription found for ID {subscription_id} to activate.")
 
 
-def handle_entitlement_cancelled(payload, db):
-    entitlement = payload.get("entitlement", {})
-    subscription_id = entitlement.get("id")
-    if not subscription_id:
-        logger.error("No subscription ID found in the message.")
+def handle_entitlement_cancelled(event, db):
+    subscription_id = event.entitlement.id
+
+    db_subscription = get_subscription(db, subscription_id, with_account=True)
+    if not db_subscription:
+        logger.error(f"No subscription found for ID {subscription_id} to cancel.")
         return
 
-    try:
-        db_subscription = (
-            db.query(Subscription)
-            .filter(Subscription.subscription_id == subscription_id)
-            .first()
+    # Update the subscription status
+    db_subscription.status = "canceled"
+    logger.info(f"Entitlement canceled: {subscription_id}")
+
+    # Update the parent account status
+    account = db_subscription.account
+    if account:
+        account.status = "entitlement canceled"
+        logger.info(
+            f"Account status updated to 'entitlement canceled': {account.procurement_account_id}"
+        )
+    else:
+        logger.error(
+            f"No account found for ID {db_subscription.account_id} to update status."
         )
-        if db_subscription:
-            # Update the subscription status
-            db_subscription.status = "canceled"
-            db.commit()
-            logger.info(f"Entitlement canceled: {subscription_id}")
-
-            # Update the parent account status
-            account = (
-                db.query(Account)
-                .filter(Account.id == db_subscription.account_id)
-                .first()
-            )
-            if account:
-                account.status = "entitlement canceled"
-                db.commit()
-                logger.info(
-                    f"Account status updated to 'entitlement canceled': {account.procurement_account_id}"
-                )
-            else:
-                logger.error(
-                    f"No account found for ID {db_subscription.account_id} to update status."
-                )
-        else:
-            logger.error(f"No subscription found for ID {subscription_id} to cancel.")
-    except Exception as e:
-        logger.error(f"Failed to cancel entitlement {subscription_id}: {e}")
 
 
-def handle_account_approved(procurement_account_id, db):
-    """Handles account approval and related entitlement approvals."""
-    db_account = (
-        db.query(Account)
-        .filter(Account.procurement_account_id == procurement_account_id)
-        .first()
+def pending_entitlements_statement(account_id):
+    return select(Subscription).where(
+        Subscription.account_id == account_id,
+        Subscription.status == "pending",
     )
-    if db_account and db_account.status == "active":
-        # Approve all pending entitlements for this account
-        pending_entitlements = (
-            db.query(Subscription)
-            .filter(
-                Subscription.account_id == db_account.id,
-                Subscription.status == "pending",
+
+
+def apply_approval_report(pending_entitlements, report):
+    """Marks the approved entitlements active and logs the failures."""
+    for entitlement, result in zip(pending_entitlements, report):
+        if result["approved"]:
+            entitlement.status = "active"
+            logger.info(f"Entitlement approved: {result['subscription_id']}")
+        else:
+            logger.error(
+                f"Failed to approve entitlement {result['subscription_id']}: {result['error']}"
             )
-            .all()
-        )
-        for entitlement in pending_entitlements:
+
+
+async def approve_entitlements_async(entitlement_ids):
+    """Approves entitlements, awaiting up to ENTITLEMENT_APPROVAL_CONCURRENCY at once.
+
+    Returns one ``{"subscription_id", "approved", "error"}`` entry per ID, in order.
+    """
+    semaphore = asyncio.Semaphore(ENTITLEMENT_APPROVAL_CONCURRENCY)
+
+    async def approve(entitlement_id):
+        async with semaphore:
             try:
-                approve_entitlement(entitlement.subscription_id)
-                entitlement.status = "active"
-                db.commit()
-                logger.info(f"Entitlement approved: {entitlement.subscription_id}")
+                await approve_entitlement_async(entitlement_id)
+                return {"subscription_id": entitlement_id, "approved": True, "error": None}
             except Exception as e:
-                logger.error(
-                    f"Failed to approve entitlement {entitlement.subscription_id}: {e}"
-                )
-    else:
-        logger.error(
-            f"No active account found for ID {procurement_account_id} to approve entitlements."
-        )
+                return {"subscription_id": entitlement_id, "approved": False, "error": str(e)}
 
+    return list(await asyncio.gather(*(approve(entitlement_id) for entitlement_id in entitlement_ids)))
 
-def handle_entitlement_deleted(payload, db):
-    entitlement = payload.get("entitlement", {})
-    subscription_id = entitlement.get("id")
-    if not subscription_id:
-        logger.error("No subscription ID found in the message.")
-        return
 
-    try:
-        db_subscription = (
-            db.query(Subscription)
-            .filter(Subscription.subscription_id == subscription_id)
-            .first()
-        )
-        if db_subscription:
-            db.delete(db_subscription)
-            db.commit()
-            logger.info(f"Entitlement deleted: {subscription_id}")
-        else:
-            logger.error(f"No subscription found for ID {subscription_id} to delete.")
-    except Exception as e:
-        logger.error(f"Failed to delete entitlement {subscription_id}: {e}")
+def handle_entitlement_deleted(event, db):
+    subscription_id = event.entitlement.id
 
+    deleted = (
+        db.query(Subscription)
+        .filter(Subscription.subscription_id == subscription_id)
+        .delete(synchronize_session=False)
+    )
+    if deleted:
+        logger.info(f"Entitlement deleted: {subscription_id}")
+    else:
+        logger.error(f"No subscription found for ID {subscription_id} to delete.")
 
-def handle_account_deleted(payload, db):
-    account_details = payload.get("account", {})
-    procurement_account_id = account_details.get("id")
-    if not procurement_account_id:
-        logger.error("No procurement account ID found in the message.")
-        return
 
-    try:
-        db_account = (
-            db.query(Account)
-            .filter(Account.procurement_account_id == procurement_account_id)
-            .first()
-        )
-        if db_account:
-            # Delete all related subscriptions first
-            db.query(Subscription).filter(
-                Subscription.account_id == db_account.id
-            ).delete()
-            db.delete(db_account)
-            db.commit()
-            logger.info(f"Account deleted: {procurement_account_id}")
-        else:
-            logger.error(f"No account found for ID {procurement_account_id} to delete.")
-    except Exception as e:
-        logger.error(f"Failed to delete account {procurement_account_id}: {e}")
+def handle_account_deleted(event, db):
+    procurement_account_id = event.account.id
 
+    # Related subscriptions are removed by ON DELETE CASCADE
+    deleted = (
+        db.query(Account)
+        .filter(Account.procurement_account_id == procurement_account_id)
+        .delete(synchronize_session=False)
+    )
+    if deleted:
+        logger.info(f"Account deleted: {procurement_account_id}")
+    else:
+        logger.error(f"No account found for ID {procurement_account_id} to delete.")
 
-def handle_entitlement_plan_change_requested(payload, db):
-    entitlement = payload.get("entitlement", {})
-    subscription_id = entitlement.get("id")
-    new_plan = entitlement.get("newPlan")
-    if not subscription_id or not new_plan:
-        logger.error("No subscription ID or new plan found in the message.")
-        return
+
+def handle_entitlement_plan_change_requested(event, db):
+    subscription_id = event.entitlement.id
+    new_plan = event.entitlement.new_plan
 
     logger.debug(
         f"Processing plan change request for subscription ID: {subscription_id} to new plan: {new_plan}"
     )
 
-    try:
-        # Update the subscription in the local database
-        db_subscription = (
-            db.query(Subscription)
-            .filter(Subscription.subscription_id == subscription_id)
-            .first()
-        )
-        if db_subscription:
-            db_subscription.plan_id = new_plan
-            db_subscription.status = "plan change requested"
-            db.commit()
-            logger.info(
-                f"Entitlement plan change requested: {subscription_id} to new plan {new_plan}"
-            )
+    # Update the subscription and its account in the local database
+    db_subscription = get_subscription(db, subscription_id, with_account=True)
+    if not db_subscription:
+        logger.error(f"No subscription found for ID {subscription_id} to change plan.")
+        return
 
-            account = (
-                db.query(Account)
-                .filter(Account.id == db_subscription.account_id)
-                .first()
-            )
-            if account:
-                account.plan_id = new_plan
-                db.commit()
-                logger.info(f"Account plan updated: {account.procurement_account_id}")
+    db_subscription.plan_id = new_plan
+    db_subscription.status = "plan change requested"
+    if db_subscription.account:
+        db_subscription.account.plan_id = new_plan
 
-            # Approve the plan change in the procurement API
-            approve_entitlement_plan_change(subscription_id, new_plan)
-        else:
-            logger.error(
-                f"No subscription found for ID {subscription_id} to change plan."
-            )
-    except Exception as e:
-        logger.error(
-            f"Failed to process plan change for entitlement {subscription_id}: {e}"
-        )
+    # Approve the plan change in the procurement API; a failure rolls back the local update
+    approve_entitlement_plan_change(subscription_id, new_plan)
+    logger.info(
+        f"Entitlement plan change requested: {subscription_id} to new plan {new_plan}"
+    )
 
 
-def handle_entitlement_plan_changed(payload, db):
-    entitlement = payload.get("entitlement", {})
-    subscription_id = entitlement.get("id")
-    if not subscription_id:
-        logger.error("No subscription ID found in the message.")
-        return
+def handle_entitlement_plan_changed(event, db):
+    subscription_id = event.entitlement.id
 
     logger.debug(f"Activating plan change for subscription ID: {subscription_id}")
 
-    try:
-        db_subscription = (
-            db.query(Subscription)
-            .filter(Subscription.subscription_id == subscription_id)
-            .first()
-        )
-        if db_subscription:
-            db_subscription.status = "active"
-            db.commit()
-            logger.info(f"Entitlement plan changed and activated: {subscription_id}")
-        else:
-            logger.error(f"No subscription found for ID {subscription_id} to activate.")
-    except Exception as e:
-        logger.error(
-            f"Failed to activate entitlement plan change for {subscription_id}: {e}"
-        )
+    db_subscription = get_subscription(db, subscription_id)
+    if db_subscription:
+        db_subscription.status = "active"
+        logger.info(f"Entitlement plan changed and activated: {subscription_id}")
+    else:
+        logger.error(f"No subscription found for ID {subscription_id} to activate.")
 
 
 def approve_entitlement_plan_change(entitlement_id, new_plan):
     """Approves the entitlement plan change in the Procurement Service."""
-    name = f"providers/{PROJECT_ID}/entitlements/{entitlement_id}:approvePlanChange"
-    body = {"pendingPlanName": new_plan}
     logger.debug(
-        f"Approving plan change for entitlement ID: {entitlement_id} with body: {body}"
+        f"Approving plan change for entitlement ID: {entitlement_id} to plan: {new_plan}"
     )
-    request = service.providers().entitlements().approvePlanChange(name=name, body=body)
-    request.execute()
+    procurement.approve_entitlement_plan_change(entitlement_id, new_plan)
+    entitlement_cache.invalidate(entitlement_id)
     logger.info(
         f"Plan change approved for entitlement: {entitlement_id} to plan: {new_plan}"
     )
 
 
-def callback(message):
-    payload = json.loads(message.data)
-    logger.info(f"Received message: {payload}")
+EVENT_HANDLERS = {
+    "ACCOUNT_ACTIVE": handle_account_active,
+    "ENTITLEMENT_CREATION_REQUESTED": handle_entitlement_event,
+    "ENTITLEMENT_ACTIVE": handle_entitlement_active,
+    "ENTITLEMENT_CANCELLED": handle_entitlement_cancelled,
+    "ENTITLEMENT_DELETED": handle_entitlement_deleted,
+    "ACCOUNT_DELETED": handle_account_deleted,
+    "ENTITLEMENT_PLAN_CHANGE_REQUESTED": handle_entitlement_plan_change_requested,
+    "ENTITLEMENT_PLAN_CHANGED": handle_entitlement_plan_changed,
+    "ENTITLEMENT_OFFER_ACCEPTED": handle_entitlement_event,
+    # Add other handlers here
+}
+
+
+def invalidate_cached_entitlement(event):
+    if event.event_type in ENTITLEMENT_CACHE_INVALIDATING_EVENTS:
+        entitlement_cache.invalidate(event.entitlement.id)
+
+
+def dispatch_event(event, db):
+    """Runs the handler registered for the event's eventType."""
+    event_type = event.event_type
+    invalidate_cached_entitlement(event)
+
+    handler = EVENT_HANDLERS.get(event_type)
+    if handler:
+        try:
+            with handler_duration.time(event_type):
+                handler(event, db)
+        except Exception:
+            handler_errors.inc(handler.__name__)
+            raise
+    else:
+        logger.error(
+            f"Unknown event type for message: {truncate_payload(event)}"
+        )
+
+
+def _event_label(event_type):
+    return event_type if event_type in EVENT_HANDLERS else "unknown"
 
-    event_type = payload.get("eventType", "")
+
+def ack(message, event_type):
+    """Acks the message and records its publish-to-ack lag."""
+    message.ack()
+    label = _event_label(event_type)
+    messages_acked.inc(label)
+    publish_time = getattr(message, "publish_time", None)
+    if publish_time is not None:
+        lag = (datetime.now(timezone.utc) - publish_time).total_seconds()
+        event_lag.observe(label, value=max(lag, 0.0))
+
+
+def nack(message, event_type):
+    """Returns the message to Pub/Sub for redelivery; the subscription's
+    retry policy decides how long it waits."""
+    message.nack()
+    messages_nacked.inc(_event_label(event_type))
+
+
+def record_dead_letter(db, message, event, error):
+    """Keeps an event that could not be processed so app.replay can rerun it."""
+    try:
+        with transaction_scope(db):
+            db.add(
+                DeadLetterEvent(
+                    message_id=message.message_id,
+                    event_id=event.event_id if event else None,
+                    event_type=event.event_type if event else None,
+                    payload=message.data.decode("utf-8", "replace"),
+                    error=str(error),
+                    replay_attempts=0,
+                )
+            )
+    except Exception as e:
+        logger.error(f"Failed to store dead letter for message {message.message_id}: {e}")
+
+
+def drop_undecodable(message, error):
+    logger.error(f"Dropping invalid message {message.message_id}: {error}")
     db = SessionLocal()
+    try:
+        record_dead_letter(db, message, None, error)
+    finally:
+        db.close()
+    ack(message, None)
 
+
+def callback(message, event=None):
+    """Processes one message; ``event`` is its decoded body, if already known.
+    Transient failures are nacked for redelivery."""
     try:
-        event_handlers = {
-            "ACCOUNT_ACTIVE": handle_account_active,
-            "ENTITLEMENT_CREATION_REQUESTED": handle_entitlement_event,
-            "ENTITLEMENT_ACTIVE": handle_entitlement_active,
-            "ENTITLEMENT_CANCELLED": handle_entitlement_cancelled,
-            "ENTITLEMENT_DELETED": handle_entitlement_deleted,
-            "ACCOUNT_DELETED": handle_account_deleted,
-            "ENTITLEMENT_PLAN_CHANGE_REQUESTED": handle_entitlement_plan_change_requested,
-            "ENTITLEMENT_PLAN_CHANGED": handle_entitlement_plan_changed,
-            "ENTITLEMENT_OFFER_ACCEPTED": handle_entitlement_event,
-            # Add other handlers here
-        }
-
-        handler = event_handlers.get(event_type)
-        if handler:
-            handler(payload, db)
+        event = event or decode_event(message.data)
+    except ValueError as e:
+        drop_undecodable(message, e)
+        return
+    if not process_message(message, event):
+        nack(message, event.event_type)
+
+
+def process_message(message, event):
+    """Processes a decoded message and acks it, unless it failed with a
+    transient error; then it returns False and the caller retries or nacks it."""
+    event_id = event.event_id
+    if processed_events.seen_recently(message.message_id, event_id):
+        logger.info(f"Skipping already processed message {message.message_id}")
+        ack(message, event.event_type)
+        return True
+
+    log_payload(
+        logger,
+        f"Received {event.event_type} message {message.message_id}",
+        message.data,
+    )
+
+    db = SessionLocal()
+    redeliver = False
+
+    try:
+        if processed_events.seen(db, message.message_id, event_id):
+            logger.info(f"Skipping already processed message {message.message_id}")
         else:
-            logger.error(f"Unknown event type for message: {payload}")
+            with transaction_scope(db):
+                dispatch_event(event, db)
+                processed_events.record(
+                    db, message.message_id, event_id, event.event_type
+                )
+            processed_events.remember(message.message_id, event_id)
     except Exception as e:
-        logger.error(f"Error processing message: {e}")
+        # Transient API failures already exhausted their retries; the rolled
+        # back transaction has no processed marker, so a retry runs it again
+        redeliver = is_transient(e)
+        logger.error(
+            f"Error processing {event.event_type} message {message.message_id}"
+            f"{' (transient)' if redeliver else ''}: {e}"
+        )
+        if not redeliver:
+            record_dead_letter(db, message, event, e)
     finally:
         db.close()
 
-    message.ack()
+    if redeliver:
+        return False
+    ack(message, event.event_type)
+    return True
+
+
+def decode_messages(items):
+    """Decodes ``(message, event)`` pairs whose event is still None; invalid
+    messages are dead-lettered and left out."""
+    decoded = []
+    for message, event in items:
+        try:
+            decoded.append((message, event or decode_event(message.data)))
+        except ValueError as e:
+            drop_undecodable(message, e)
+    return decoded
+
+
+def unprocessed_events(db, decoded):
+    """Drops ``(message, event)`` pairs already processed or repeated in ``decoded``."""
+    message_ids, event_ids, events = set(), set(), []
+    for message, event in decoded:
+        event_id = event.event_id
+        if (
+            message.message_id in message_ids
+            or (event_id and event_id in event_ids)
+            or processed_events.seen(db, message.message_id, event_id)
+        ):
+            logger.info(f"Skipping already processed message {message.message_id}")
+            continue
+        message_ids.add(message.message_id)
+        if event_id:
+            event_ids.add(event_id)
+        events.append((message, event))
+    return events
+
+
+def apply_in_savepoints(db, events, apply):
+    """Runs ``apply(message, event)`` for each ``(message, event)`` pair in
+    its own savepoint, in order, and stops at the first one that raises.
+
+    Returns how many were applied. The caller commits those, so handlers
+    that already called the Procurement API do not run twice; the failed
+    event and the ones after it are left to the caller. Releasing a
+    savepoint flushes, so each event sees the ORM changes of the earlier ones.
+    """
+    for index, (message, event) in enumerate(events):
+        try:
+            with db.begin_nested():
+                apply(message, event)
+        except Exception as e:
+            logger.warning(
+                f"{event.event_type} message {message.message_id} failed, processing it "
+                f"and the {len(events) - index - 1} after it one at a time: {e}"
+            )
+            return index
+    return len(events)
+
+
+class InOrderProcessor:
+    """Processes the messages of one worker in order, retrying a transient
+    failure in place instead of nacking it, so a later event for the same
+    entitlement or account never overtakes it.
+
+    Once ``stop()`` is called a failing message is nacked, and the later
+    messages for its entitlement or account are nacked without running.
+    """
+
+    def __init__(self):
+        self._stopping = threading.Event()
+        self._held = set()
+
+    def stop(self):
+        self._stopping.set()
+
+    def without_held(self, decoded):
+        """Nacks the ``(message, event)`` pairs queued behind a nacked message
+        for the same key and returns the others."""
+        if not self._held:
+            return decoded
+        rest = []
+        for message, event in decoded:
+            if (partition_key(event) or message.message_id) in self._held:
+                logger.warning(
+                    f"Nacking {event.event_type} message {message.message_id}, "
+                    "an earlier event for its entitlement or account was nacked"
+                )
+                nack(message, event.event_type)
+            else:
+                rest.append((message, event))
+        return rest
+
+    def process(self, message, event=None):
+        try:
+            event = event or decode_event(message.data)
+        except ValueError as e:
+            drop_undecodable(message, e)
+            return
+        if not self.without_held([(message, event)]):
+            return
+        attempt = 0
+        while not process_message(message, event):
+            if self._stopping.is_set():
+                self._held.add(partition_key(event) or message.message_id)
+                nack(message, event.event_type)
+                return
+            delay = min(PUBSUB_LANE_RETRY_MAX_DELAY, PUBSUB_LANE_RETRY_BASE_DELAY * 2**attempt)
+            logger.warning(
+                f"Retrying {event.event_type} message {message.message_id} in "
+                f"{delay:.1f}s; later events for {partition_key(event)} wait for it"
+            )
+            self._stopping.wait(delay)
+            attempt += 1
+
+
+class MessageBatcher:
+    """Collects messages for up to ``max_size`` messages or ``max_wait`` seconds
+    and applies the whole batch in one session with a single commit.
+
+    If a handler fails, the messages before it are still committed, and it
+    and the messages after it are reprocessed one at a time, in order, by an
+    ``InOrderProcessor``.
+    """
+
+    def __init__(self, max_size, max_wait):
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._pending = []
+        # Arrival time of each pending message, oldest first
+        self._arrivals = []
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._in_order = InOrderProcessor()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._in_order.stop()
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+
+    def add(self, message, event=None):
+        with self._condition:
+            self._pending.append((message, event))
+            self._arrivals.append(time.monotonic())
+            # Wake the worker to start the max_wait timer, or to take a full batch
+            if len(self._pending) == 1 or len(self._pending) >= self.max_size:
+                self._condition.notify()
+
+    def _take_batch(self):
+        with self._condition:
+            while True:
+                if self._pending:
+                    remaining = self._arrivals[0] + self.max_wait - time.monotonic()
+                    if len(self._pending) >= self.max_size or remaining <= 0 or not self._running:
+                        batch = self._pending[: self.max_size]
+                        del self._pending[: self.max_size]
+                        del self._arrivals[: self.max_size]
+                        return batch
+                    self._condition.wait(remaining)
+                elif not self._running:
+                    return None
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                self.process_batch(batch)
+            except Exception as e:
+                logger.error(f"Error processing batch of {len(batch)} messages: {e}")
+
+    def process_batch(self, items):
+        started = time.monotonic()
+        decoded = self._in_order.without_held(decode_messages(items))
+
+        db = SessionLocal()
+        try:
+            with transaction_scope(db):
+                events = unprocessed_events(db, decoded)
+                applied = apply_in_savepoints(db, events, partial(self._apply, db))
+        except Exception as e:
+            logger.warning(
+                f"Batch of {len(decoded)} messages failed, processing one at a time: {e}"
+            )
+            db.close()
+            batch_fallbacks.inc()
+            for message, event in decoded:
+                self._in_order.process(message, event)
+        else:
+            db.close()
+            done, rest = events[:applied], events[applied:]
+            rest_ids = {message.message_id for message, _ in rest}
+            for message, event in done:
+                processed_events.remember(message.message_id, event.event_id)
+            for message, event in decoded:
+                if message.message_id not in rest_ids:
+                    ack(message, event.event_type)
+            if rest:
+                batch_fallbacks.inc()
+                for message, event in rest:
+                    self._in_order.process(message, event)
+
+        elapsed = time.monotonic() - started
+        batch_duration.observe(value=elapsed)
+        batch_messages.inc(amount=len(decoded))
+        logger.info(
+            f"Processed batch of {len(decoded)} messages in {elapsed * 1000:.1f} ms "
+            f"({len(decoded) / elapsed if elapsed else 0:.0f} msg/s)"
+        )
+
+    def _apply(self, db, message, event):
+        log_payload(
+            logger,
+            f"Received {event.event_type} message {message.message_id}",
+            message.data,
+        )
+        dispatch_event(event, db)
+        processed_events.record(db, message.message_id, event.event_id, event.event_type)
+
+
+class OrderedLane:
+    """Processes its messages one at a time, in arrival order; a transient
+    failure is retried before the next message runs."""
+
+    _STOP = object()
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._in_order = InOrderProcessor()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._in_order.stop()
+        self._queue.put(self._STOP)
+        if self._thread:
+            self._thread.join()
+
+    def add(self, message, event=None):
+        self._queue.put((message, event))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            message, event = item
+            try:
+                self._in_order.process(message, event)
+            except Exception as e:
+                logger.error(f"Error processing message {message.message_id}: {e}")
+
+
+def partition_key(event):
+    """Returns the entitlement or account ID whose events must stay in order."""
+    return event.entity_id
+
+
+class PartitionedDispatcher:
+    """Hashes each message to a lane by entitlement or account ID.
+
+    Events in the same lane run in order, different lanes run in parallel,
+    so two events for one entitlement never race on the same row.
+    """
+
+    def __init__(self, lanes):
+        self.lanes = lanes
+
+    def start(self):
+        for lane in self.lanes:
+            lane.start()
+
+    def stop(self):
+        for lane in self.lanes:
+            lane.stop()
+
+    def add(self, message):
+        try:
+            event = decode_event(message.data)
+        except ValueError:
+            # The lane rejects it; any lane will do
+            event = None
+        key = (event and partition_key(event)) or message.message_id
+        self.lanes[zlib.crc32(key.encode()) % len(self.lanes)].add(message, event)
+
+
+# Entitlement events only mark the subscription active; any later event for
+# the same entitlement overwrites their effect
+STATUS_ONLY_EVENTS = {"ENTITLEMENT_ACTIVE", "ENTITLEMENT_PLAN_CHANGED"}
+# Entitlement events that refetch the entitlement and rewrite its subscription
+CREATION_EVENTS = {"ENTITLEMENT_CREATION_REQUESTED", "ENTITLEMENT_OFFER_ACCEPTED"}
+
+
+def coalesce_events(events):
+    """Splits one entity's ``(message, event)`` pairs, in arrival order, into
+    the events to dispatch and those a later event makes redundant.
+
+    A status-only event is redundant when any entitlement event follows it,
+    and a creation event when the next dispatched event is another creation,
+    which refetches the same entitlement. Plan change approvals,
+    cancellations, deletions and account events always run.
+    """
+    kept, superseded = [], []
+    later_event = False
+    for message, event in reversed(events):
+        event_type = event.event_type
+        if later_event and (
+            event_type in STATUS_ONLY_EVENTS
+            or (event_type in CREATION_EVENTS and kept[-1][1].event_type in CREATION_EVENTS)
+        ):
+            superseded.append((message, event))
+        else:
+            kept.append((message, event))
+        later_event = later_event or (
+            event_type in EVENT_HANDLERS and event_type.startswith("ENTITLEMENT_")
+        )
+    kept.reverse()
+    superseded.reverse()
+    return kept, superseded
+
+
+class EventCoalescer:
+    """Holds messages for ``window`` seconds, grouped by entitlement or account
+    ID, and applies each group in one transaction after dropping the events
+    ``coalesce_events`` finds redundant.
+
+    Every message of the group is marked processed and acked once the group
+    commits. If an event fails, the events before it are still committed,
+    and it and the events after it are reprocessed one at a time, in order,
+    by an ``InOrderProcessor``.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        # Key -> (deadline, messages); deadlines only grow, so the first group is due first
+        self._groups = {}
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._in_order = InOrderProcessor()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._in_order.stop()
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+
+    def add(self, message, event=None):
+        if event is None:
+            try:
+                event = decode_event(message.data)
+            except ValueError:
+                event = None
+        key = (event and partition_key(event)) or message.message_id
+        with self._condition:
+            group = self._groups.get(key)
+            if group is None:
+                self._groups[key] = (time.monotonic() + self.window, [(message, event)])
+                self._condition.notify()
+            else:
+                group[1].append((message, event))
+
+    def _take_group(self):
+        with self._condition:
+            while True:
+                if self._groups:
+                    key, (deadline, messages) = next(iter(self._groups.items()))
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._running:
+                        del self._groups[key]
+                        return messages
+                    self._condition.wait(remaining)
+                elif not self._running:
+                    return None
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            group = self._take_group()
+            if group is None:
+                return
+            try:
+                self.process_group(group)
+            except Exception as e:
+                logger.error(f"Error processing group of {len(group)} messages: {e}")
+
+    def process_group(self, items):
+        decoded = self._in_order.without_held(decode_messages(items))
+        coalesce_groups.inc()
+        coalesce_messages.inc(amount=len(decoded))
+
+        db = SessionLocal()
+        try:
+            with transaction_scope(db):
+                events = unprocessed_events(db, decoded)
+                kept, superseded = coalesce_events(events)
+                superseded_ids = {message.message_id for message, _ in superseded}
+
+                def apply(message, event):
+                    if message.message_id in superseded_ids:
+                        invalidate_cached_entitlement(event)
+                        logger.info(
+                            f"Coalesced {event.event_type} message {message.message_id}"
+                        )
+                    else:
+                        log_payload(
+                            logger,
+                            f"Received {event.event_type} message {message.message_id}",
+                            message.data,
+                        )
+                        dispatch_event(event, db)
+                    processed_events.record(
+                        db, message.message_id, event.event_id, event.event_type
+                    )
+
+                applied = apply_in_savepoints(db, events, apply)
+        except Exception as e:
+            logger.warning(
+                f"Group of {len(decoded)} messages failed, processing one at a time: {e}"
+            )
+            db.close()
+            coalesce_fallbacks.inc()
+            for message, event in decoded:
+                self._in_order.process(message, event)
+            return
+        db.close()
+
+        done, rest = events[:applied], events[applied:]
+        rest_ids = {message.message_id for message, _ in rest}
+        for message, event in done:
+            processed_events.remember(message.message_id, event.event_id)
+            if message.message_id in superseded_ids:
+                events_coalesced.inc(_event_label(event.event_type))
+        for message, event in decoded:
+            if message.message_id not in rest_ids:
+                ack(message, event.event_type)
+        if rest:
+            coalesce_fallbacks.inc()
+            for message, event in rest:
+                self._in_order.process(message, event)
+
+
+def worker_count(requested, setting):
+    """Caps a worker count so every worker can hold a DB connection and a
+    Procurement API slot at the same time. 0 means use the cap."""
+    limit = min(DB_POOL_CAPACITY, PROCUREMENT_MAX_CONCURRENCY)
+    workers = requested or limit
+    if workers > limit:
+        logger.warning(
+            f"{setting}={workers} exceeds the DB pool capacity "
+            f"({DB_POOL_CAPACITY}) or PROCUREMENT_MAX_CONCURRENCY "
+            f"({PROCUREMENT_MAX_CONCURRENCY}); using {limit}"
+        )
+        workers = limit
+    if PUBSUB_MAX_MESSAGES < workers:
+        logger.warning(
+            f"PUBSUB_MAX_MESSAGES={PUBSUB_MAX_MESSAGES} is lower than the "
+            f"{workers} workers of {setting}; some will stay idle"
+        )
+    return workers
+
+
+def _new_lane():
+    if PUBSUB_COALESCE_WINDOW_MS > 0:
+        return EventCoalescer(PUBSUB_COALESCE_WINDOW_MS / 1000)
+    if PUBSUB_BATCH_SIZE > 1:
+        return MessageBatcher(PUBSUB_BATCH_SIZE, PUBSUB_BATCH_MAX_WAIT_MS / 1000)
+    return OrderedLane()
+
+
+def build_message_sink():
+    """Returns the worker messages are handed to, or None to process them on
+    the subscriber's callback threads."""
+    if PUBSUB_PARTITION_LANES > 0:
+        lanes = worker_count(PUBSUB_PARTITION_LANES, "PUBSUB_PARTITION_LANES")
+        logger.info(f"Partitioning events into {lanes} ordered lanes")
+        return PartitionedDispatcher([_new_lane() for _ in range(lanes)])
+    if PUBSUB_COALESCE_WINDOW_MS > 0 or PUBSUB_BATCH_SIZE > 1:
+        return _new_lane()
+    return None
 
 
 def subscribe_to_pubsub():
+    # Imported here, the client library is slow to import and only the leader pulls
+    from google.cloud import pubsub_v1
+    from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
     subscriber = pubsub_v1.SubscriberClient()
     subscription_path = subscriber.subscription_path("landgriffon", PUBSUB_SUBSCRIPTION)
 
     logger.info(f"Subscription path: {subscription_path}")
 
-    def wrapped_callback(message):
-        callback(message)
+    db = SessionLocal()
+    try:
+        processed_events.prune(db, PROCESSED_EVENTS_RETENTION_DAYS)
+    except Exception as e:
+        logger.error(f"Failed to prune processed events: {e}")
+    finally:
+        db.close()
+
+    global _sink
+    _sink = build_message_sink()
+    if _sink:
+        _sink.start()
+        wrapped_callback = _sink.add
+        # Callbacks only enqueue; a single thread keeps the delivery order intact
+        threads = 1
+    else:
+        wrapped_callback = callback
+        threads = worker_count(PUBSUB_CALLBACK_THREADS, "PUBSUB_CALLBACK_THREADS")
+
+    if PUBSUB_COALESCE_WINDOW_MS > 0:
+        logger.info(
+            f"Coalescing events per entitlement or account for {PUBSUB_COALESCE_WINDOW_MS} ms"
+        )
+        if PUBSUB_BATCH_SIZE > 1:
+            logger.warning("PUBSUB_BATCH_SIZE is ignored while PUBSUB_COALESCE_WINDOW_MS is set")
+    elif PUBSUB_BATCH_SIZE > 1:
+        logger.info(
+            f"Batching up to {PUBSUB_BATCH_SIZE} messages or {PUBSUB_BATCH_MAX_WAIT_MS} ms"
+        )
+
+    flow_control = pubsub_v1.types.FlowControl(
+        max_messages=PUBSUB_MAX_MESSAGES, max_bytes=PUBSUB_MAX_BYTES
+    )
+    scheduler = ThreadScheduler(
+        executor=ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="pubsub-callback"
+        )
+    )
 
-    subscription = subscriber.subscribe(subscription_path, callback=wrapped_callback)
-    logger.info(f"Listening for messages on {subscription_path}")
+    global _subscription
+    with _subscriber_lock:
+        if _stop_requested.is_set():
+            if _sink:
+                _sink.stop()
+            subscriber.close()
+            return
+        subscription = _subscription = subscriber.subscribe(
+            subscription_path,
+            callback=wrapped_callback,
+            flow_control=flow_control,
+            scheduler=scheduler,
+        )
+    logger.info(
+        f"Listening for messages on {subscription_path} with {threads} callback "
+        f"threads, max {PUBSUB_MAX_MESSAGES} messages / {PUBSUB_MAX_BYTES} bytes outstanding"
+    )
     try:
         subscription.result()
     except Exception as e:
-        logger.error(
-            f"Listening for messages on {subscription_path} threw an Exception: {e}"
-        )
+        if subscription.cancelled():
+            logger.info(f"Stopped listening for messages on {subscription_path}")
+        else:
+            logger.error(
+                f"Listening for messages on {subscription_path} threw an Exception: {e}"
+            )
+    finally:
+        subscriber.close()
+
+
+def start_subscriber():
+    """Runs ``subscribe_to_pubsub`` in a daemon thread and returns the thread."""
+    _stop_requested.clear()
+    thread = threading.Thread(target=subscribe_to_pubsub, daemon=True)
+    thread.start()
+    return thread
 
 
 def stop_subscriber():
-    global _running
-    _running = False
+    global _subscription, _sink
+    with _subscriber_lock:
+        _stop_requested.set()
+        subscription, _subscription = _subscription, None
+    if subscription:
+        # Stops the streaming pull; outstanding messages are nacked and redelivered
+        subscription.cancel()
+    if _sink:
+        _sink.stop()
+        _sink = None
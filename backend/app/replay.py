@@ -0,0 +1,319 @@
+"""Replays marketplace events through the Pub/Sub handlers without Pub/Sub.
+
+Events come from an NDJSON file (one event payload per line, ``-`` for
+stdin) or from the ``dead_letter_events`` table:
+
+    cd backend
+    python -m app.replay --file events.ndjson --workers 8 --batch-size 20
+    python -m app.replay --dead-letters --event-type ENTITLEMENT_CREATION_REQUESTED --dry-run
+
+Events for the same entitlement or account are replayed in order on the
+same worker. Events whose eventId was already processed are skipped unless
+``--force`` is given. ``--dry-run`` only decodes and counts the events, it
+runs no handlers and calls no API.
+"""
+import argparse
+import logging
+import queue
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+
+from sqlalchemy import func, select, update
+
+from app.database import SessionLocal, transaction_scope
+from app.events import decode_event
+from app.logging_config import setup_logging
+from app.models import DeadLetterEvent
+from app.pubsub import apply_in_savepoints, dispatch_event, partition_key, processed_events
+
+logger = logging.getLogger(__name__)
+
+MAX_LISTED_FAILURES = 20
+
+
+class ReplayEvent:
+    def __init__(self, data, message_id=None, dead_letter_id=None, source=None):
+        self.data = data
+        self.message_id = message_id or f"replay-{uuid.uuid4()}"
+        self.dead_letter_id = dead_letter_id
+        self.source = source
+        self.decoded = None
+
+
+def read_ndjson(path):
+    stream = sys.stdin if path == "-" else open(path)
+    try:
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                yield ReplayEvent(line, source=f"{path}:{line_number}")
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def read_dead_letters(event_type=None, limit=None, page_size=500):
+    """Yields unreplayed dead letters in id order, one page per session."""
+    last_id = 0
+    remaining = limit
+    while remaining is None or remaining > 0:
+        statement = (
+            select(DeadLetterEvent)
+            .where(DeadLetterEvent.replayed_at.is_(None), DeadLetterEvent.id > last_id)
+            .order_by(DeadLetterEvent.id)
+            .limit(page_size if remaining is None else min(page_size, remaining))
+        )
+        if event_type:
+            statement = statement.where(DeadLetterEvent.event_type == event_type)
+        db = SessionLocal()
+        try:
+            rows = db.execute(statement).scalars().all()
+        finally:
+            db.close()
+        if not rows:
+            return
+        for row in rows:
+            yield ReplayEvent(
+                row.payload,
+                message_id=row.message_id,
+                dead_letter_id=row.id,
+                source=f"dead letter {row.id}",
+            )
+        last_id = rows[-1].id
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+class Replayer:
+    """Dispatches events on ``workers`` ordered lanes, ``batch_size`` events
+    per transaction. When an event fails, the events before it are committed
+    and the failed event and the rest of the batch are retried one at a time,
+    so only the failing events are counted as failures."""
+
+    _STOP = object()
+
+    def __init__(self, workers=4, batch_size=1, dry_run=False, force=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.force = force
+        self.counts = Counter()
+        self.event_types = Counter()
+        self.failures = []
+        self._lock = threading.Lock()
+        self._lanes = [queue.Queue(maxsize=batch_size * 4) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(lane,), daemon=True)
+            for lane in self._lanes
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, event):
+        try:
+            event.decoded = decode_event(event.data)
+        except ValueError as e:
+            self._count("failed", event, e)
+            self._note_failure(event, e)
+            return
+        key = partition_key(event.decoded) or event.message_id
+        self._lanes[zlib.crc32(key.encode()) % len(self._lanes)].put(event)
+
+    def finish(self):
+        for lane in self._lanes:
+            lane.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, lane):
+        while True:
+            event = lane.get()
+            if event is self._STOP:
+                return
+            batch = [event]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    event = lane.get_nowait()
+                except queue.Empty:
+                    break
+                if event is self._STOP:
+                    stop = True
+                    break
+                batch.append(event)
+            self._apply(batch)
+            if stop:
+                return
+
+    def _apply(self, batch):
+        db = SessionLocal()
+        outcomes = []
+        try:
+            if self.dry_run:
+                for event in batch:
+                    self._count(self._check(db, event), event)
+                return
+            with transaction_scope(db):
+                if len(batch) == 1:
+                    outcomes.append(self._dispatch(db, batch[0]))
+                else:
+                    # The events before a failing one keep their savepoints, so
+                    # their Procurement API calls are not made again
+                    applied = apply_in_savepoints(
+                        db,
+                        [(event, event.decoded) for event in batch],
+                        lambda event, decoded: outcomes.append(self._dispatch(db, event)),
+                    )
+                    del outcomes[applied:]
+        except Exception as e:
+            db.close()
+            if len(batch) > 1:
+                # The commit failed, none of the batch was written
+                for event in batch:
+                    self._apply([event])
+            else:
+                self._count("failed", batch[0], e)
+                self._note_failure(batch[0], e)
+            return
+        finally:
+            db.close()
+
+        for event, outcome in zip(batch, outcomes):
+            if outcome == "applied":
+                processed_events.remember(event.message_id, event.decoded.event_id)
+            self._count(outcome, event)
+        for event in batch[len(outcomes):]:
+            self._apply([event])
+
+    def _check(self, db, event):
+        if not self.force and processed_events.seen(
+            db, event.message_id, event.decoded.event_id
+        ):
+            return "skipped"
+        return "would_apply"
+
+    def _dispatch(self, db, event):
+        event_id = event.decoded.event_id
+        if self._check(db, event) == "skipped":
+            outcome = "skipped"
+        else:
+            dispatch_event(event.decoded, db)
+            # Flush so the next event's statements see this one's ORM changes
+            db.flush()
+            message_id = event.message_id
+            if self.force and processed_events.seen(db, message_id, None):
+                message_id = f"replay-{uuid.uuid4()}"
+            processed_events.record(
+                db, message_id, event_id, event.decoded.event_type
+            )
+            outcome = "applied"
+        if event.dead_letter_id:
+            db.execute(
+                update(DeadLetterEvent)
+                .where(DeadLetterEvent.id == event.dead_letter_id)
+                .values(
+                    replayed_at=func.now(),
+                    replay_attempts=DeadLetterEvent.replay_attempts + 1,
+                )
+            )
+        return outcome
+
+    def _note_failure(self, event, error):
+        if not event.dead_letter_id:
+            return
+        db = SessionLocal()
+        try:
+            with transaction_scope(db):
+                db.execute(
+                    update(DeadLetterEvent)
+                    .where(DeadLetterEvent.id == event.dead_letter_id)
+                    .values(
+                        error=str(error),
+                        replay_attempts=DeadLetterEvent.replay_attempts + 1,
+                    )
+                )
+        except Exception as e:
+            logger.error(f"Failed to update dead letter {event.dead_letter_id}: {e}")
+        finally:
+            db.close()
+
+    def _count(self, outcome, event, error=None):
+        with self._lock:
+            self.counts[outcome] += 1
+            if event.decoded:
+                self.event_types[event.decoded.event_type] += 1
+            if error is not None:
+                self.failures.append((event, error))
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+def print_report(replayer, elapsed):
+    total = replayer.total
+    print(
+        f"Replayed {total} events in {elapsed:.1f}s "
+        f"({total / elapsed if elapsed else 0:.1f} events/s)"
+    )
+    for outcome in ("applied", "would_apply", "skipped", "failed"):
+        if replayer.counts[outcome]:
+            print(f"  {outcome}: {replayer.counts[outcome]}")
+    for event_type, count in replayer.event_types.most_common():
+        print(f"  {event_type}: {count}")
+    for event, error in replayer.failures[:MAX_LISTED_FAILURES]:
+        print(f"  failed {event.source}: {error}")
+    if len(replayer.failures) > MAX_LISTED_FAILURES:
+        print(f"  ... and {len(replayer.failures) - MAX_LISTED_FAILURES} more failures")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="NDJSON file of event payloads, - for stdin")
+    source.add_argument(
+        "--dead-letters", action="store_true", help="Replay unreplayed dead letters"
+    )
+    parser.add_argument("--event-type", help="Only replay dead letters of this type")
+    parser.add_argument("--limit", type=int, help="Replay at most this many dead letters")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--force", action="store_true", help="Replay processed events too")
+    parser.add_argument("--progress-interval", type=float, default=5.0)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    setup_logging()
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    if args.file:
+        events = read_ndjson(args.file)
+    else:
+        events = read_dead_letters(args.event_type, args.limit)
+
+    replayer = Replayer(args.workers, args.batch_size, args.dry_run, args.force)
+    replayer.start()
+    started = last_report = time.monotonic()
+    for event in events:
+        replayer.submit(event)
+        now = time.monotonic()
+        if now - last_report >= args.progress_interval:
+            last_report = now
+            print(
+                f"{replayer.total} events, {replayer.counts['failed']} failed, "
+                f"{replayer.total / (now - started):.1f} events/s",
+                flush=True,
+            )
+    replayer.finish()
+
+    print_report(replayer, time.monotonic() - started)
+    sys.exit(1 if replayer.counts["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
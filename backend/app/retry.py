@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+from sqlalchemy import exc as sa_exc
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while its circuit breaker is open."""
+
+
+def status_code(error):
+    if isinstance(error, HttpError):
+        return error.resp.status
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return None
+
+
+def is_transient(error):
+    """True for failures worth retrying later: rate limits, 5xx responses,
+    timeouts, connection errors, an open circuit breaker, and database
+    errors such as a lost connection, a lock timeout or a deadlock."""
+    if isinstance(error, CircuitOpenError):
+        return True
+    code = status_code(error)
+    if code is not None:
+        return code in TRANSIENT_STATUS_CODES
+    if isinstance(error, sa_exc.DBAPIError):
+        # Drivers raise OperationalError for failures of the database rather than the statement
+        return error.connection_invalidated or isinstance(error, sa_exc.OperationalError)
+    return isinstance(
+        error,
+        (
+            httpx.TransportError,
+            httplib2.HttpLib2Error,
+            TimeoutError,
+            ConnectionError,
+            sa_exc.TimeoutError,
+        ),
+    )
+
+
+def retry_after(error):
+    """Seconds from a Retry-After header, if the error response has one."""
+    if isinstance(error, HttpError):
+        value = error.resp.get("retry-after")
+    elif isinstance(error, httpx.HTTPStatusError):
+        value = error.response.headers.get("retry-after")
+    else:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Bounded exponential backoff with full jitter.
+
+    ``attempts`` counts the first call, so ``attempts=4`` retries three
+    times. A Retry-After header is honoured up to ``max_delay``.
+    """
+
+    def __init__(self, attempts=4, base_delay=0.5, max_delay=10.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error, attempt):
+        return (
+            attempt + 1 < self.attempts
+            and is_transient(error)
+            and not isinstance(error, CircuitOpenError)
+        )
+
+    def delay(self, error, attempt):
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """Fails calls fast after ``failure_threshold`` consecutive transient errors.
+
+    Once open, calls raise CircuitOpenError for ``reset_timeout`` seconds,
+    then a single trial call is let through: success closes the circuit,
+    failure opens it again. Errors that are not transient (e.g. a 404) show
+    the API is up and count as successes.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError, or returns True if the call is the half-open trial."""
+        with self._lock:
+            if self.state == "open":
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(
+                        f"Circuit open after {self.failures} failures, retrying in {remaining:.1f}s"
+                    )
+                self.state = "half_open"
+                self._trial_in_flight = True
+                return True
+            if self.state == "half_open":
+                if self._trial_in_flight:
+                    raise CircuitOpenError("Circuit half open, waiting for the trial call")
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, error=None):
+        """Records the outcome of a call let through by before_call."""
+        with self._lock:
+            self._trial_in_flight = False
+            if error is None or not is_transient(error):
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def cancel(self):
+        """Releases the trial slot of a trial call that ended without an
+        outcome, e.g. one cancelled while waiting, so the next call becomes
+        the trial."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    @property
+    def is_open(self):
+        return self.state != "closed"
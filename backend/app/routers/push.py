@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import binascii
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import jwt
+from fastapi import APIRouter, HTTPException, Request, Response
+
+from app.google_keys import GoogleKeyCache
+from app.http_client import get_http_client
+from app.metrics import Counter, registry
+from app.pubsub import callback, worker_count
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# Push requests carry a Google-signed OIDC token for this audience, issued to this service
+# account, or the shared token as ?token=
+PUBSUB_PUSH_AUDIENCE = os.getenv("PUBSUB_PUSH_AUDIENCE")
+PUBSUB_PUSH_SERVICE_ACCOUNT = os.getenv("PUBSUB_PUSH_SERVICE_ACCOUNT")
+PUBSUB_PUSH_TOKEN = os.getenv("PUBSUB_PUSH_TOKEN")
+# Messages handled at once per instance; further pushes get 429 so Pub/Sub backs off
+PUBSUB_PUSH_MAX_CONCURRENCY = int(os.getenv("PUBSUB_PUSH_MAX_CONCURRENCY", "0"))
+GOOGLE_OIDC_CERTS_URL = os.getenv(
+    "GOOGLE_OIDC_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs"
+)
+GOOGLE_OIDC_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+oidc_keys = GoogleKeyCache(GOOGLE_OIDC_CERTS_URL)
+
+push_rejected = registry.register(
+    Counter(
+        "pubsub_push_rejected_total",
+        "Push requests answered with 429 because all handler slots were busy.",
+    )
+)
+
+
+class PushMessage:
+    """Adapts a push envelope to the message interface ``callback`` expects;
+    the ack or nack becomes the HTTP status of the push request."""
+
+    def __init__(self, envelope):
+        message = envelope["message"]
+        self.data = base64.b64decode(message.get("data", ""), validate=True)
+        # Processed events are keyed by message ID, an envelope without one cannot be recorded
+        self.message_id = message.get("messageId") or message.get("message_id")
+        if not self.message_id:
+            raise KeyError("messageId")
+        self.attributes = message.get("attributes") or {}
+        self.delivery_attempt = envelope.get("deliveryAttempt")
+        publish_time = message.get("publishTime") or message.get("publish_time")
+        self.publish_time = (
+            datetime.fromisoformat(publish_time.replace("Z", "+00:00"))
+            if publish_time
+            else None
+        )
+        self.outcome = None
+
+    def ack(self):
+        self.outcome = "ack"
+
+    def nack(self):
+        self.outcome = "nack"
+
+
+class PushHandler:
+    """Runs ``callback`` for push requests on a bounded thread pool."""
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self._executor = None
+        self._in_flight = 0
+
+    def try_acquire(self):
+        if self._in_flight >= self.max_concurrency:
+            return False
+        self._in_flight += 1
+        return True
+
+    async def handle(self, message):
+        try:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_concurrency, thread_name_prefix="pubsub-push"
+                )
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, callback, message
+            )
+        finally:
+            self._in_flight -= 1
+
+    def stop(self):
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+push_handler = PushHandler(
+    worker_count(PUBSUB_PUSH_MAX_CONCURRENCY, "PUBSUB_PUSH_MAX_CONCURRENCY")
+)
+
+
+def push_enabled():
+    return bool(PUBSUB_PUSH_AUDIENCE or PUBSUB_PUSH_TOKEN)
+
+
+async def validate_push_request(request: Request):
+    if PUBSUB_PUSH_TOKEN and request.query_params.get("token") != PUBSUB_PUSH_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if not PUBSUB_PUSH_AUDIENCE:
+        return
+
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    try:
+        key = await oidc_keys.get_key_async(
+            jwt.get_unverified_header(token)["kid"], get_http_client()
+        )
+        claims = jwt.decode(
+            token, key, algorithms=["RS256"], audience=PUBSUB_PUSH_AUDIENCE
+        )
+    except (jwt.InvalidTokenError, KeyError):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if claims.get("iss") not in GOOGLE_OIDC_ISSUERS:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # Any Google identity can mint a token for the audience, so the issuing account must match
+    if (
+        not PUBSUB_PUSH_SERVICE_ACCOUNT
+        or claims.get("email") != PUBSUB_PUSH_SERVICE_ACCOUNT
+        or not claims.get("email_verified")
+    ):
+        raise HTTPException(status_code=401, detail="Unexpected push service account")
+
+
+@router.post("/pubsub/push")
+async def pubsub_push(request: Request):
+    if not push_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    await validate_push_request(request)
+
+    try:
+        message = PushMessage(await request.json())
+    except (ValueError, KeyError, TypeError, AttributeError, binascii.Error) as e:
+        # Acking would lose the event, a 400 leaves it to the subscription's dead-letter policy
+        logger.error(f"Invalid push envelope: {e}")
+        raise HTTPException(status_code=400, detail="Invalid push envelope")
+
+    if not push_handler.try_acquire():
+        push_rejected.inc()
+        return Response(status_code=429)
+    await push_handler.handle(message)
+
+    if message.outcome == "ack":
+        return Response(status_code=204)
+    # Any non-2xx status makes Pub/Sub redeliver the message with backoff
+    return Response(status_code=503)
@@ -1,20 +1,32 @@
+import hashlib
+import hmac
 import os
+import time
+from urllib.parse import quote
 from fastapi import APIRouter, Depends, HTTPException, Request
-from datetime import datetime
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-import httpx
 import jwt
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_transaction_scope, engine, get_async_db
+from app.db_pool import pool_stats
+from app.google_keys import GoogleKeyCache
+from app.http_client import get_http_client
+from app.metrics import registry, signup_phase_duration
 from app.models import Account, Subscription
+from app.outbox import OutboxWorker, enqueue_task, latest_task
 from pydantic import BaseModel
 from app.pubsub import (
-    approve_account,
-    handle_account_approved,
-    approve_entitlement,
-    fetch_entitlement_details,
-    _generate_internal_account_id,
+    account_upsert_statement,
+    apply_approval_report,
+    approve_account_async,
+    approve_entitlement_async,
+    approve_entitlements_async,
+    entitlement_cache,
+    fetch_entitlement_details_async,
+    pending_entitlements_statement,
+    procurement,
 )
 import logging
 
@@ -26,6 +38,20 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 JWT_ISSUER = "https://www.googleapis.com/robot/v1/metadata/x509/cloud-commerce-partner@system.gserviceaccount.com"
 JWT_AUDIENCE = os.getenv("PARTNER_DOMAIN_NAME")
 
+# POST /signup sets a cookie, valid this many seconds, that lets the browser poll the signup status
+SIGNUP_STATUS_TTL = int(os.getenv("SIGNUP_STATUS_TTL", "3600"))
+SIGNUP_COOKIE_SECURE = os.getenv("SIGNUP_COOKIE_SECURE", "true").lower() == "true"
+SIGNUP_COOKIE = "signup_status"
+
+# The tokens' signing keys are published at the issuer URL; override to use a local key server
+GOOGLE_KEYS_URL = os.getenv("GOOGLE_KEYS_URL", JWT_ISSUER)
+
+google_keys = GoogleKeyCache(
+    GOOGLE_KEYS_URL,
+    refresh_margin=int(os.getenv("GOOGLE_KEYS_REFRESH_MARGIN", "300")),
+    min_refresh_interval=int(os.getenv("GOOGLE_KEYS_MIN_REFRESH_INTERVAL", "30")),
+)
+
 
 # Schemas
 class JWTData(BaseModel):
@@ -37,17 +63,16 @@ class JWTData(BaseModel):
     google: dict
 
 
-def get_google_public_key(kid):
-    response = httpx.get(JWT_ISSUER)
-    response.raise_for_status()
-    keys = response.json()
-    return keys[kid]
+async def get_google_public_key(kid):
+    return await google_keys.get_key_async(kid, get_http_client())
 
 
-def validate_jwt(token):
-    unverified_header = jwt.get_unverified_header(token)
-    kid = unverified_header["kid"]
-    public_key = get_google_public_key(kid)
+async def validate_jwt(token):
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+        public_key = await get_google_public_key(unverified_header["kid"])
+    except (jwt.InvalidTokenError, KeyError):
+        raise HTTPException(status_code=401, detail="Invalid token")
 
     try:
         payload = jwt.decode(
@@ -66,13 +91,48 @@ def validate_jwt(token):
 
 
 def validate_secret_header(request: Request):
-    secret = request.headers.get("x-internal-secret")
-    if secret != SECRET_KEY:
+    secret = request.headers.get("x-internal-secret") or ""
+    # Without a SECRET_KEY every internal endpoint stays closed
+    if not SECRET_KEY or not hmac.compare_digest(secret.encode(), SECRET_KEY.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+def signup_status_signature(procurement_account_id, expires):
+    return hmac.new(
+        (SECRET_KEY or "").encode(),
+        f"signup-status:{procurement_account_id}:{expires}".encode(),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def signup_status_token(procurement_account_id):
+    """A token for reading one account's signup status, signed with SECRET_KEY."""
+    expires = int(time.time()) + SIGNUP_STATUS_TTL
+    return f"{expires}.{signup_status_signature(procurement_account_id, expires)}"
+
+
+def validate_signup_status_token(request: Request, procurement_account_id):
+    expires, _, signature = (request.cookies.get(SIGNUP_COOKIE) or "").partition(".")
+    if (
+        not SECRET_KEY
+        or not expires.isdigit()
+        or int(expires) < time.time()
+        or not hmac.compare_digest(
+            signature, signup_status_signature(procurement_account_id, int(expires))
+        )
+    ):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
 
+class EntitlementApprovalSchema(BaseModel):
+    subscription_id: str
+    approved: bool
+    error: str | None = None
+
+
 class AccountApprovalSchema(BaseModel):
     internal_account_id: str
+    entitlements: list[EntitlementApprovalSchema] = []
 
 
 class SubscriptionSchema(BaseModel):
@@ -108,109 +168,204 @@ def thanks(request: Request):
 
 
 @router.post("/signup")
-def signup(request: Request, db: Session = Depends(get_db)):
-    logger.info(f"Request headers: {request.headers}")
+async def signup(request: Request, db: AsyncSession = Depends(get_async_db)):
     token = request.headers.get("x-gcp-marketplace-token")
     if not token:
         raise HTTPException(status_code=400, detail="Missing JWT token")
 
-    jwt_data = validate_jwt(token)
+    with signup_phase_duration.time("jwt"):
+        jwt_data = await validate_jwt(token)
 
     procurement_account_id = jwt_data.sub
 
-    account = (
-        db.query(Account)
-        .filter(Account.procurement_account_id == procurement_account_id)
-        .first()
+    # The account and its approval task are written together, the outbox worker
+    # approves the account in the background while the user is redirected
+    with signup_phase_duration.time("db"):
+        async with async_transaction_scope(db):
+            await db.execute(account_upsert_statement(db, procurement_account_id))
+            status = (
+                await db.execute(
+                    select(Account.status).where(
+                        Account.procurement_account_id == procurement_account_id
+                    )
+                )
+            ).scalar()
+            if status == "pending":
+                await enqueue_task(db, "approve_account", procurement_account_id)
+    outbox_worker.notify()
+
+    logger.info(f"Account approval queued for procurement_account_id: {procurement_account_id}")
+    signup_path = f"/signup/{quote(procurement_account_id, safe='')}"
+    response = RedirectResponse(url=signup_path, status_code=303)
+    # Scoped to this signup's pages, so only its status page can be polled
+    response.set_cookie(
+        SIGNUP_COOKIE,
+        signup_status_token(procurement_account_id),
+        max_age=SIGNUP_STATUS_TTL,
+        path=signup_path,
+        secure=SIGNUP_COOKIE_SECURE,
+        httponly=True,
+        samesite="lax",
     )
-    if not account:
-        internal_account_id = _generate_internal_account_id()
-        account = Account(
-            procurement_account_id=procurement_account_id,
-            internal_account_id=internal_account_id,
-            status="pending",
-        )
-        db.add(account)
-    db.commit()
+    return response
 
-    try:
-        approve_account_endpoint(procurement_account_id, db)
-        logger.info(
-            f"Account approved successfully for procurement_account_id: {procurement_account_id}"
-        )
-        return RedirectResponse(url="/success")
-    except Exception as e:
-        logger.error(f"Failed to approve account: {e}")
-        return RedirectResponse(url=f"/failure?reason={str(e)}")
 
+@router.get("/signup/{procurement_account_id}", response_class=HTMLResponse)
+def signup_pending(request: Request, procurement_account_id: str):
+    return templates.TemplateResponse(
+        "pending.html",
+        {"request": request, "procurement_account_id": procurement_account_id},
+    )
 
-@router.post(
-    "/accounts/{procurement_account_id}/approve", response_model=AccountApprovalSchema
-)
-def approve_account_endpoint(
-    procurement_account_id: str, db: Session = Depends(get_db)
+
+@router.get("/signup/{procurement_account_id}/status")
+async def signup_status(
+    procurement_account_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    validate_secret_header(httpx.request)
+    validate_signup_status_token(request, procurement_account_id)
     account = (
-        db.query(Account)
-        .filter(Account.procurement_account_id == procurement_account_id)
-        .first()
-    )
+        await db.execute(
+            select(Account).where(
+                Account.procurement_account_id == procurement_account_id
+            )
+        )
+    ).scalar_one_or_none()
+    if not account:
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    task = await latest_task(db, "approve_account", procurement_account_id)
+    approval_status = task.status if task else None
+    # Every state but a pending approval is final, so the status page stops polling
+    if account.status == "active":
+        result, reason = "approved", None
+    elif account.status != "pending":
+        result, reason = "failed", "Account is not in a pending state"
+    elif approval_status == "failed":
+        result, reason = "failed", "Your account could not be approved automatically"
+    else:
+        result, reason = "pending", None
+    return {
+        "account_status": account.status,
+        "approval_status": approval_status,
+        "result": result,
+        "reason": reason,
+    }
+
+
+async def approve_pending_account(procurement_account_id, db):
+    """Approves a pending account, then its pending entitlements.
+
+    The account's new status is committed on its own right after the remote
+    approval, and a retry of an approval that already went through remotely
+    counts as approved, so a failed commit never leaves it stuck.
+    """
+    account = (
+        await db.execute(
+            select(Account).where(
+                Account.procurement_account_id == procurement_account_id
+            )
+        )
+    ).scalar_one_or_none()
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
 
     if account.status != "pending":
         raise HTTPException(status_code=400, detail="Account is not in a pending state")
+    # End the read's transaction, no connection is held across the API calls
+    await db.commit()
 
     try:
-        approve_account(procurement_account_id)
-        account.status = "active"
-        db.commit()
-        handle_account_approved(
-            procurement_account_id, db
-        )  # Approve related entitlements
-        return account
+        await approve_account_async(procurement_account_id)
+        async with async_transaction_scope(db):
+            account.status = "active"
+
+        # Approve related entitlements
+        pending_entitlements = (
+            (await db.execute(pending_entitlements_statement(account.id)))
+            .scalars()
+            .all()
+        )
+        await db.commit()
+        report = []
+        if pending_entitlements:
+            report = await approve_entitlements_async(
+                [entitlement.subscription_id for entitlement in pending_entitlements]
+            )
+            async with async_transaction_scope(db):
+                apply_approval_report(pending_entitlements, report)
+        return {
+            "internal_account_id": account.internal_account_id,
+            "entitlements": report,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to approve account: {e}")
 
 
+async def run_account_approval(procurement_account_id, db):
+    """Outbox handler for signups."""
+    try:
+        await approve_pending_account(procurement_account_id, db)
+    except HTTPException as e:
+        if e.status_code == 400:
+            # Already approved, e.g. by a previous attempt that lost its lease
+            return
+        raise
+    logger.info(
+        f"Account approved successfully for procurement_account_id: {procurement_account_id}"
+    )
+
+
+outbox_worker = OutboxWorker({"approve_account": run_account_approval})
+
+
+@router.post(
+    "/accounts/{procurement_account_id}/approve", response_model=AccountApprovalSchema
+)
+async def approve_account_endpoint(
+    procurement_account_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+):
+    validate_secret_header(request)
+    return await approve_pending_account(procurement_account_id, db)
+
+
 @router.post("/subscriptions/{subscription_id}/approve")
-def approve_subscription_endpoint(subscription_id: str, db: Session = Depends(get_db)):
-    validate_secret_header(httpx.request)
+async def approve_subscription_endpoint(
+    subscription_id: str, request: Request, db: AsyncSession = Depends(get_async_db)
+):
+    validate_secret_header(request)
     subscription = (
-        db.query(Subscription)
-        .filter(Subscription.subscription_id == subscription_id)
-        .first()
-    )
+        await db.execute(
+            select(Subscription).where(Subscription.subscription_id == subscription_id)
+        )
+    ).scalar_one_or_none()
     if not subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
+    # End the read's transaction, no connection is held across the API calls
+    await db.commit()
 
     try:
         # Fetch the entitlement details to get the associated account ID and plan details
-        entitlement_details = fetch_entitlement_details(subscription_id)
-        procurement_account_id = entitlement_details.get("account").split("/")[-1]
-        plan_id = entitlement_details.get("plan")
-        start_time = entitlement_details.get("createTime")
-        consumer_id = entitlement_details.get("usageReportingId")
-
-        start_time = datetime.fromisoformat(start_time.replace("Z", "+00:00"))
-
-        # Update the account with the new plan_id, start_time, and consumer_id
-        account = (
-            db.query(Account)
-            .filter(Account.procurement_account_id == procurement_account_id)
-            .first()
-        )
-        if account:
-            account.plan_id = plan_id
-            account.start_time = start_time
-            account.consumer_id = consumer_id
-            db.commit()
+        entitlement_details = await fetch_entitlement_details_async(subscription_id)
+        procurement_account_id = entitlement_details.account_id
+        plan_id = entitlement_details.plan
+        start_time = entitlement_details.create_time
+        consumer_id = entitlement_details.usage_reporting_id
 
         # Approve the entitlement
-        approve_entitlement(subscription_id)
-        subscription.status = "active"
-        db.commit()
+        await approve_entitlement_async(subscription_id)
+
+        async with async_transaction_scope(db):
+            # Update the account with the new plan_id, start_time, and consumer_id
+            await db.execute(
+                update(Account)
+                .where(Account.procurement_account_id == procurement_account_id)
+                .values(plan_id=plan_id, start_time=start_time, consumer_id=consumer_id)
+            )
+            subscription.status = "active"
         logger.info(f"Entitlement approved: {subscription_id}")
         return {"message": "Subscription approved successfully"}
     except Exception as e:
@@ -218,3 +373,85 @@ def approve_subscription_endpoint(subscription_id: str, db: Session = Depends(ge
         raise HTTPException(
             status_code=500, detail=f"Failed to approve subscription: {e}"
         )
+
+
+# Internal Endpoints
+@router.get("/internal/cache-stats")
+def cache_stats(request: Request):
+    validate_secret_header(request)
+    return {"entitlement_details": entitlement_cache.stats()}
+
+
+@router.get("/internal/db-pool")
+def db_pool_stats(request: Request):
+    validate_secret_header(request)
+    return pool_stats.snapshot(engine.pool)
+
+
+def internal_gauges():
+    """Reports the DB pool and entitlement cache stats as gauges at scrape time."""
+    pool = pool_stats.snapshot(engine.pool)
+    cache = entitlement_cache.stats()
+    return [
+        (
+            f"db_pool_{name}",
+            f"Sync engine connection pool {name.replace('_', ' ')}.",
+            {(): pool[name]},
+            (),
+        )
+        for name in ("checked_out", "overflow")
+        if name in pool
+    ] + [
+        (
+            "entitlement_cache_size",
+            "Entitlement details cache size.",
+            {(): cache["size"]},
+            (),
+        )
+    ] + [
+        (
+            "procurement_api_circuit_open",
+            "1 while the Procurement API circuit breaker rejects calls.",
+            {(): int(procurement.breaker.is_open)},
+            (),
+        )
+    ]
+
+
+def internal_counters():
+    """Reports the cumulative DB pool and entitlement cache stats as counters."""
+    pool = pool_stats.snapshot(engine.pool)
+    cache = entitlement_cache.stats()
+    return [
+        (
+            f"db_pool_{name}_total",
+            f"Sync engine connection pool {name.replace('_', ' ')}.",
+            {(): pool[key]},
+            (),
+        )
+        for name, key in (
+            ("checkouts", "checkouts"),
+            ("checkout_wait_seconds", "checkout_wait_seconds_total"),
+            ("timeouts", "timeouts"),
+        )
+    ] + [
+        (
+            f"entitlement_cache_{name}_total",
+            f"Entitlement details cache {name}.",
+            {(): cache[name]},
+            (),
+        )
+        for name in ("hits", "misses", "evictions")
+    ]
+
+
+registry.register_collector(internal_gauges)
+registry.register_collector(internal_counters, "counter")
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics(request: Request):
+    validate_secret_header(request)
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
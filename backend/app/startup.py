@@ -0,0 +1,59 @@
+"""Cold start timing, logged once the app is ready to serve requests."""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from app.config import load_environment
+from app.metrics import registry
+
+load_environment()
+
+logger = logging.getLogger(__name__)
+
+# Cold starts slower than this many milliseconds are logged as warnings
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "3000"))
+
+
+class StartupTimer:
+    """Times named startup phases, counted from when this module is imported."""
+
+    def __init__(self, budget_ms=STARTUP_BUDGET_MS):
+        self.budget_ms = budget_ms
+        self.started = time.perf_counter()
+        self.total_ms = None
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, (time.perf_counter() - started) * 1000))
+
+    def report(self):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+        breakdown = ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.phases)
+        level = logging.WARNING if self.total_ms > self.budget_ms else logging.INFO
+        logger.log(
+            level,
+            f"Started in {self.total_ms:.0f} ms (budget {self.budget_ms:.0f} ms): {breakdown}",
+        )
+
+    def gauges(self):
+        values = {(name,): ms / 1000 for name, ms in self.phases}
+        if self.total_ms is not None:
+            values[("total",)] = self.total_ms / 1000
+        return [
+            (
+                "app_startup_duration_seconds",
+                "Time spent in each startup phase of this process.",
+                values,
+                ("phase",),
+            )
+        ]
+
+
+startup_timer = StartupTimer()
+registry.register_collector(startup_timer.gauges)
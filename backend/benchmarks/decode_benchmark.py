@@ -0,0 +1,95 @@
+"""Measures the per-message cost of decoding Pub/Sub event bodies.
+
+Compares the typed decoder the handlers use (``app.events.decode_event``,
+one pass of pydantic-core's compiled schema) with plain ``json.loads`` plus
+the dict lookups the handlers used to do, and with orjson when installed:
+
+    cd backend
+    python -m benchmarks.decode_benchmark
+    python -m benchmarks.decode_benchmark --events 20000 --rounds 7 --output decode.json
+
+No database or network is used.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app.events import decode_event, event_adapter
+
+from benchmarks.e2e_benchmark import make_events
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_messages(count):
+    """Encodes synthetic events with the extra fields real notifications carry."""
+    messages = []
+    for payload in make_events(count):
+        payload["providerId"] = "landgriffon"
+        for field in ("account", "entitlement"):
+            if field in payload:
+                payload[field]["updateTime"] = "2024-01-01T00:00:00.000000Z"
+        messages.append(json.dumps(payload).encode())
+    return messages
+
+
+def dict_lookups(payload):
+    payload.get("eventId")
+    payload.get("eventType")
+    for field in ("entitlement", "account"):
+        entity = payload.get(field, {})
+        if entity.get("id"):
+            return entity.get("newPlan")
+
+
+def decoders():
+    yield "json.loads + dict lookups", lambda data: dict_lookups(json.loads(data))
+    if orjson:
+        yield "orjson.loads + dict lookups", lambda data: dict_lookups(orjson.loads(data))
+    yield "decode_event (pydantic validate_json)", decode_event
+    if orjson:
+        yield "orjson.loads + validate_python", lambda data: event_adapter.validate_python(
+            orjson.loads(data)
+        )
+
+
+def measure(decode, messages, rounds):
+    """Returns the median microseconds per message over ``rounds`` passes."""
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for data in messages:
+            decode(data)
+        timings.append((time.perf_counter() - started) / len(messages) * 1e6)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    messages = make_messages(args.events)
+    print(
+        f"{len(messages)} messages, {sum(map(len, messages)) / len(messages):.0f} bytes on average"
+    )
+    results = {}
+    for name, decode in decoders():
+        decode(messages[0])
+        us = measure(decode, messages, args.rounds)
+        results[name] = {"us_per_message": us, "messages_per_second": 1e6 / us}
+        print(f"  {name}: {us:.2f} us/message ({1e6 / us:,.0f} messages/s)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
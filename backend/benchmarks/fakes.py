@@ -0,0 +1,206 @@
+"""In-process stand-ins for Pub/Sub messages, the Procurement API and
+Google's JWT signing key endpoint, used by the benchmarks."""
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+
+class FakeMessage:
+    """Quacks like a streaming pull message and records when it was settled."""
+
+    _ids = iter(range(1, 1 << 62))
+    _ids_lock = threading.Lock()
+
+    def __init__(self, payload, on_settled=None):
+        with self._ids_lock:
+            self.message_id = str(next(self._ids))
+        self.data = json.dumps(payload).encode()
+        self.size = len(self.data)
+        self.attributes = {}
+        self.delivery_attempt = None
+        self.publish_time = datetime.now(timezone.utc)
+        self.delivered_at = None
+        self.settled_at = None
+        self.outcome = None
+        self._on_settled = on_settled
+        self._settled = threading.Event()
+
+    def ack(self):
+        self._settle("ack")
+
+    def nack(self):
+        self._settle("nack")
+
+    def modify_ack_deadline(self, seconds):
+        pass
+
+    def wait(self, timeout=None):
+        return self._settled.wait(timeout)
+
+    @property
+    def latency(self):
+        return self.settled_at - self.delivered_at
+
+    def _settle(self, outcome):
+        if self._settled.is_set():
+            return
+        self.settled_at = time.perf_counter()
+        self.outcome = outcome
+        self._settled.set()
+        if self._on_settled:
+            self._on_settled(self)
+
+
+class _Server:
+    def __init__(self, handler):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeProcurementServer(_Server):
+    """Serves the Procurement API endpoints the handlers call.
+
+    Every request sleeps ``latency`` seconds and fails with ``error_status``
+    with probability ``error_rate``. Entitlement ``ent-N`` belongs to
+    account ``acc-N``, and every account reads back as approved.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                name = self.path.split("?")[0].rstrip("/").split("/")[-1]
+                if "/accounts/" in self.path:
+                    server.reply(
+                        self,
+                        {
+                            "name": f"providers/bench/accounts/{name}",
+                            "state": "ACCOUNT_ACTIVE",
+                            "approvals": [{"name": "signup", "state": "APPROVED"}],
+                        },
+                    )
+                    return
+                account = name.replace("ent-", "acc-", 1)
+                server.reply(
+                    self,
+                    {
+                        "name": name,
+                        "account": f"providers/bench/accounts/{account}",
+                        "product": "landgriffon",
+                        "plan": "standard",
+                        "usageReportingId": f"usage-{name}",
+                        "createTime": "2024-01-01T00:00:00Z",
+                    },
+                )
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                server.reply(self, {})
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(Handler)
+
+    def reply(self, handler, body):
+        if self.latency:
+            time.sleep(self.latency)
+        failed = self.error_rate and random.random() < self.error_rate
+        with self._lock:
+            self.requests += 1
+            self.errors += bool(failed)
+        status, body = (self.error_status, {"error": "injected"}) if failed else (200, body)
+        data = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class FakeKeyServer(_Server):
+    """Publishes a self-signed x509 certificate like Google's key endpoint
+    and signs marketplace JWTs with the matching private key."""
+
+    KEY_ID = "bench"
+
+    def __init__(self, max_age=3600):
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "benchmark")])
+        now = datetime.now(timezone.utc)
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(self._key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(days=1))
+            .not_valid_after(now + timedelta(days=1))
+            .sign(self._key, hashes.SHA256())
+        )
+        body = json.dumps(
+            {self.KEY_ID: certificate.public_bytes(serialization.Encoding.PEM).decode()}
+        ).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", f"public, max-age={max_age}")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(Handler)
+
+    def sign(self, subject, audience, issuer, lifetime=300):
+        now = int(time.time())
+        return jwt.encode(
+            {
+                "iss": issuer,
+                "aud": audience,
+                "sub": subject,
+                "iat": now,
+                "exp": now + lifetime,
+                "google": {"roles": ["account_admin"]},
+            },
+            self._key,
+            algorithm="RS256",
+            headers={"kid": self.KEY_ID},
+        )
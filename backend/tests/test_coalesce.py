@@ -0,0 +1,96 @@
+import json
+
+from app.events import decode_event
+from app.pubsub import coalesce_events
+
+
+def pairs(*event_types):
+    """(message ID, event) pairs for one entitlement, in arrival order."""
+    return [
+        (
+            str(index),
+            decode_event(
+                json.dumps(
+                    {
+                        "eventId": str(index),
+                        "eventType": event_type,
+                        "entitlement": {"id": "ent-1", "newPlan": "plan-2"},
+                    }
+                )
+            ),
+        )
+        for index, event_type in enumerate(event_types)
+    ]
+
+
+def types(events):
+    return [event.event_type for _, event in events]
+
+
+def test_status_only_event_is_superseded_by_a_later_entitlement_event():
+    kept, superseded = coalesce_events(pairs("ENTITLEMENT_ACTIVE", "ENTITLEMENT_CANCELLED"))
+    assert types(kept) == ["ENTITLEMENT_CANCELLED"]
+    assert types(superseded) == ["ENTITLEMENT_ACTIVE"]
+
+
+def test_last_event_always_runs():
+    kept, superseded = coalesce_events(pairs("ENTITLEMENT_PLAN_CHANGED"))
+    assert types(kept) == ["ENTITLEMENT_PLAN_CHANGED"]
+    assert superseded == []
+
+
+def test_creation_is_superseded_only_by_the_next_dispatched_creation():
+    kept, superseded = coalesce_events(
+        pairs("ENTITLEMENT_CREATION_REQUESTED", "ENTITLEMENT_OFFER_ACCEPTED")
+    )
+    assert [message for message, _ in kept] == ["1"]
+    assert [message for message, _ in superseded] == ["0"]
+
+    kept, superseded = coalesce_events(
+        pairs(
+            "ENTITLEMENT_CREATION_REQUESTED",
+            "ENTITLEMENT_PLAN_CHANGE_REQUESTED",
+            "ENTITLEMENT_CREATION_REQUESTED",
+        )
+    )
+    assert [message for message, _ in kept] == ["0", "1", "2"]
+    assert superseded == []
+
+
+def test_status_only_events_between_creations_do_not_hide_the_second_creation():
+    kept, superseded = coalesce_events(
+        pairs(
+            "ENTITLEMENT_CREATION_REQUESTED",
+            "ENTITLEMENT_ACTIVE",
+            "ENTITLEMENT_CREATION_REQUESTED",
+        )
+    )
+    assert [message for message, _ in kept] == ["2"]
+    assert [message for message, _ in superseded] == ["0", "1"]
+
+
+def test_side_effects_always_run():
+    event_types = (
+        "ENTITLEMENT_PLAN_CHANGE_REQUESTED",
+        "ENTITLEMENT_PLAN_CHANGE_REQUESTED",
+        "ENTITLEMENT_CANCELLED",
+        "ENTITLEMENT_DELETED",
+    )
+    kept, superseded = coalesce_events(pairs(*event_types))
+    assert types(kept) == list(event_types)
+    assert superseded == []
+
+
+def test_unknown_entitlement_events_do_not_supersede():
+    kept, superseded = coalesce_events(pairs("ENTITLEMENT_ACTIVE", "ENTITLEMENT_SUSPENDED"))
+    assert types(kept) == ["ENTITLEMENT_ACTIVE", "ENTITLEMENT_SUSPENDED"]
+    assert superseded == []
+
+
+def test_account_events_do_not_supersede():
+    events = pairs("ENTITLEMENT_ACTIVE") + [
+        ("1", decode_event('{"eventType": "ACCOUNT_DELETED", "account": {"id": "acc-1"}}'))
+    ]
+    kept, superseded = coalesce_events(events)
+    assert types(kept) == ["ENTITLEMENT_ACTIVE", "ACCOUNT_DELETED"]
+    assert superseded == []
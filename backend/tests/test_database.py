@@ -0,0 +1,20 @@
+from app.database import pool_sizes
+
+
+def test_pools_keep_their_settings_without_a_connection_budget():
+    assert pool_sizes(5, 10) == (5, 10)
+
+
+def test_pools_are_capped_to_each_workers_share_of_the_budget():
+    # 100 connections over 4 workers: 25 each, one for the leader lock, 12 per engine
+    assert pool_sizes(5, 10, max_connections=100, workers=4) == (5, 7)
+    size, overflow = pool_sizes(5, 10, max_connections=50, workers=4)
+    assert 4 * (2 * (size + overflow) + 1) <= 50
+
+
+def test_pools_never_exceed_their_own_settings_under_a_large_budget():
+    assert pool_sizes(5, 10, max_connections=1000, workers=2) == (5, 10)
+
+
+def test_each_engine_keeps_one_connection_under_a_tiny_budget():
+    assert pool_sizes(5, 10, max_connections=4, workers=4) == (1, 0)
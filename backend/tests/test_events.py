@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from app.events import (
+    AccountEvent,
+    EntitlementEvent,
+    InvalidEventError,
+    PlanChangeRequestedEvent,
+    UnknownEvent,
+    decode_event,
+)
+
+
+def encode(payload):
+    return json.dumps(payload).encode()
+
+
+def test_decodes_entitlement_events():
+    event = decode_event(
+        encode(
+            {
+                "eventId": "evt-1",
+                "eventType": "ENTITLEMENT_ACTIVE",
+                "providerId": "landgriffon",
+                "entitlement": {"id": "ent-1", "updateTime": "2024-01-01T00:00:00Z"},
+            }
+        )
+    )
+    assert isinstance(event, EntitlementEvent)
+    assert event.event_id == "evt-1"
+    assert event.entity_id == "ent-1"
+    assert event.entitlement.new_plan is None
+
+
+def test_decodes_account_and_plan_change_events():
+    account = decode_event(encode({"eventType": "ACCOUNT_DELETED", "account": {"id": "acc-1"}}))
+    assert isinstance(account, AccountEvent)
+    assert account.entity_id == "acc-1"
+
+    plan_change = decode_event(
+        encode(
+            {
+                "eventType": "ENTITLEMENT_PLAN_CHANGE_REQUESTED",
+                "entitlement": {"id": "ent-1", "newPlan": "plan-2"},
+            }
+        )
+    )
+    assert isinstance(plan_change, PlanChangeRequestedEvent)
+    assert plan_change.entitlement.new_plan == "plan-2"
+
+
+def test_unknown_event_types_decode_to_unknown_events():
+    event = decode_event(encode({"eventId": "evt-1", "eventType": "ENTITLEMENT_SUSPENDED"}))
+    assert isinstance(event, UnknownEvent)
+    assert event.event_type == "ENTITLEMENT_SUSPENDED"
+    assert event.entity_id is None
+
+    assert isinstance(decode_event(encode({"eventId": "evt-2"})), UnknownEvent)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"not json",
+        encode(["ENTITLEMENT_ACTIVE"]),
+        encode({"eventType": "ENTITLEMENT_ACTIVE"}),
+        encode({"eventType": "ENTITLEMENT_ACTIVE", "entitlement": {}}),
+        encode({"eventType": "ENTITLEMENT_ACTIVE", "entitlement": {"id": ""}}),
+        encode({"eventType": "ACCOUNT_ACTIVE", "entitlement": {"id": "ent-1"}}),
+        encode({"eventType": "ENTITLEMENT_PLAN_CHANGE_REQUESTED", "entitlement": {"id": "ent-1"}}),
+        encode({"eventType": "ENTITLEMENT_ACTIVE", "eventId": 7, "entitlement": {"id": "ent-1"}}),
+    ],
+)
+def test_rejects_malformed_events(data):
+    with pytest.raises(InvalidEventError):
+        decode_event(data)
+
+
+def test_rejection_names_the_invalid_field():
+    with pytest.raises(InvalidEventError, match="entitlement.newPlan"):
+        decode_event(
+            encode(
+                {
+                    "eventType": "ENTITLEMENT_PLAN_CHANGE_REQUESTED",
+                    "entitlement": {"id": "ent-1"},
+                }
+            )
+        )
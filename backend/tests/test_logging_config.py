@@ -0,0 +1,43 @@
+import logging
+from typing import ClassVar
+
+from app import logging_config
+from app.events import EntitlementDetails
+from app.logging_config import log_payload
+
+
+class CountingDetails(EntitlementDetails):
+    dumps: ClassVar[int] = 0
+
+    def model_dump_json(self, **kwargs):
+        type(self).dumps += 1
+        return super().model_dump_json(**kwargs)
+
+
+def details():
+    CountingDetails.dumps = 0
+    return CountingDetails(account="providers/p/accounts/acc-1", create_time="2024-01-01T00:00:00Z")
+
+
+def test_models_are_not_serialized_when_the_level_is_off():
+    logger = logging.getLogger("test.payload.off")
+    logger.setLevel(logging.WARNING)
+    log_payload(logger, "Entitlement details", details())
+    assert CountingDetails.dumps == 0
+
+
+def test_models_are_not_serialized_when_the_payload_is_not_sampled(monkeypatch, caplog):
+    monkeypatch.setattr(logging_config, "LOG_PAYLOAD_SAMPLE_RATE", 0.0)
+    logger = logging.getLogger("test.payload.unsampled")
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        log_payload(logger, "Entitlement details", details())
+    assert CountingDetails.dumps == 0
+    assert caplog.messages == ["Entitlement details"]
+
+
+def test_models_are_serialized_by_alias_when_logged(caplog):
+    logger = logging.getLogger("test.payload.on")
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        log_payload(logger, "Entitlement details", details())
+    assert CountingDetails.dumps == 1
+    assert '"account":"providers/p/accounts/acc-1"' in caplog.messages[0]
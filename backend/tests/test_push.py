@@ -0,0 +1,111 @@
+import base64
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import push
+
+AUDIENCE = "https://marketplace.test/pubsub/push"
+SERVICE_ACCOUNT = "pubsub-push@project.iam.gserviceaccount.com"
+signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def token(email=SERVICE_ACCOUNT, audience=AUDIENCE, key=signing_key):
+    now = int(time.time())
+    claims = {
+        "iss": "https://accounts.google.com",
+        "aud": audience,
+        "iat": now,
+        "exp": now + 300,
+        "email_verified": True,
+    }
+    if email:
+        claims["email"] = email
+    return jwt.encode(claims, key, algorithm="RS256", headers={"kid": "k1"})
+
+
+def envelope(message_id="msg-1"):
+    message = {
+        "data": base64.b64encode(json.dumps({"eventType": "ACCOUNT_ACTIVE"}).encode()).decode(),
+        "publishTime": "2024-01-01T00:00:00Z",
+    }
+    if message_id:
+        message["messageId"] = message_id
+    return {"message": message, "subscription": "projects/p/subscriptions/s"}
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    """Push client with OIDC auth on; returns it with the list of handled message IDs."""
+
+    async def get_key_async(kid, client):
+        if kid != "k1":
+            raise KeyError(kid)
+        return signing_key.public_key()
+
+    received = []
+
+    def callback(message):
+        received.append(message.message_id)
+        message.ack()
+
+    monkeypatch.setattr(push, "PUBSUB_PUSH_AUDIENCE", AUDIENCE)
+    monkeypatch.setattr(push, "PUBSUB_PUSH_SERVICE_ACCOUNT", SERVICE_ACCOUNT)
+    monkeypatch.setattr(push, "PUBSUB_PUSH_TOKEN", None)
+    monkeypatch.setattr(push.oidc_keys, "get_key_async", get_key_async)
+    monkeypatch.setattr(push, "callback", callback)
+    monkeypatch.setattr(push, "push_handler", push.PushHandler(2))
+
+    app = FastAPI()
+    app.include_router(push.router)
+    with TestClient(app) as client:
+        yield client, received
+    push.push_handler.stop()
+
+
+def post(client, body, bearer=None):
+    headers = {"Authorization": f"Bearer {bearer}"} if bearer else {}
+    return client.post("/pubsub/push", json=body, headers=headers)
+
+
+def test_accepts_a_token_from_the_push_service_account(handled):
+    client, received = handled
+    response = post(client, envelope(), token())
+    assert response.status_code == 204
+    assert received == ["msg-1"]
+
+
+@pytest.mark.parametrize(
+    "bearer",
+    [
+        None,
+        "not-a-jwt",
+        token(email="someone-else@project.iam.gserviceaccount.com"),
+        token(email=None),
+        token(audience="https://other.test/pubsub/push"),
+        token(key=rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+    ],
+    ids=["missing", "malformed", "other-account", "no-email", "other-audience", "forged"],
+)
+def test_rejects_tokens_not_issued_to_the_push_service_account(handled, bearer):
+    client, received = handled
+    assert post(client, envelope(), bearer).status_code == 401
+    assert received == []
+
+
+def test_rejects_every_token_when_no_service_account_is_configured(handled, monkeypatch):
+    client, received = handled
+    monkeypatch.setattr(push, "PUBSUB_PUSH_SERVICE_ACCOUNT", None)
+    assert post(client, envelope(), token()).status_code == 401
+    assert received == []
+
+
+def test_rejects_an_envelope_without_a_message_id(handled):
+    client, received = handled
+    assert post(client, envelope(message_id=None), token()).status_code == 400
+    assert received == []
@@ -0,0 +1,65 @@
+import json
+from collections import Counter
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import replay
+from app.database import Base
+from app.idempotency import ProcessedEventStore
+from app.replay import ReplayEvent, Replayer
+
+
+@pytest.fixture
+def dispatched(tmp_path, monkeypatch):
+    """Replays into a fresh SQLite database; returns the dispatch count per
+    entitlement, and entitlements whose name starts with "bad" fail."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'replay.db'}")
+    Base.metadata.create_all(engine)
+    calls = Counter()
+
+    def dispatch_event(event, db):
+        calls[event.entity_id] += 1
+        if event.entity_id.startswith("bad"):
+            raise RuntimeError(f"{event.entity_id} failed")
+
+    monkeypatch.setattr(replay, "SessionLocal", sessionmaker(bind=engine))
+    monkeypatch.setattr(replay, "dispatch_event", dispatch_event)
+    monkeypatch.setattr(replay, "processed_events", ProcessedEventStore(100))
+    yield calls
+    engine.dispose()
+
+
+def replay_batch(*entitlement_ids):
+    replayer = Replayer(workers=1, batch_size=len(entitlement_ids))
+    # Queued before the worker starts, so they are applied as one batch
+    for entitlement_id in entitlement_ids:
+        replayer.submit(
+            ReplayEvent(
+                json.dumps(
+                    {
+                        "eventId": f"evt-{entitlement_id}",
+                        "eventType": "ENTITLEMENT_ACTIVE",
+                        "entitlement": {"id": entitlement_id},
+                    }
+                )
+            )
+        )
+    replayer.start()
+    replayer.finish()
+    return replayer
+
+
+def test_batch_applies_every_event_once(dispatched):
+    replayer = replay_batch("ent-1", "ent-2", "ent-3")
+    assert replayer.counts == {"applied": 3}
+    assert dispatched == {"ent-1": 1, "ent-2": 1, "ent-3": 1}
+
+
+def test_failed_batch_keeps_the_events_before_the_failure(dispatched):
+    replayer = replay_batch("ent-1", "ent-2", "bad-3", "ent-4")
+    assert replayer.counts == {"applied": 3, "failed": 1}
+    assert [str(error) for _, error in replayer.failures] == ["bad-3 failed"]
+    # Only the failed event runs again on its own
+    assert dispatched == {"ent-1": 1, "ent-2": 1, "bad-3": 2, "ent-4": 1}
@@ -0,0 +1,138 @@
+import asyncio
+import sqlite3
+
+import httpx
+import pytest
+from sqlalchemy import exc as sa_exc
+
+from app import procurement
+from app.procurement import ProcurementClient
+from app.retry import CircuitBreaker, CircuitOpenError, is_transient
+
+
+def transient_error():
+    request = httpx.Request("GET", "http://procurement.test")
+    return httpx.HTTPStatusError(
+        "503", request=request, response=httpx.Response(503, request=request)
+    )
+
+
+def not_found_error():
+    request = httpx.Request("GET", "http://procurement.test")
+    return httpx.HTTPStatusError(
+        "404", request=request, response=httpx.Response(404, request=request)
+    )
+
+
+def open_breaker(reset_timeout=30):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=reset_timeout)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record(transient_error())
+    return breaker
+
+
+def test_opens_after_consecutive_transient_failures():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.before_call()
+    breaker.record(transient_error())
+    assert breaker.state == "closed"
+    breaker.before_call()
+    breaker.record(transient_error())
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_success_and_non_transient_errors_reset_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.before_call()
+    breaker.record(transient_error())
+    breaker.before_call()
+    breaker.record(not_found_error())
+    breaker.before_call()
+    breaker.record(transient_error())
+    assert breaker.state == "closed"
+    assert breaker.failures == 1
+
+
+def test_half_open_lets_a_single_trial_through():
+    breaker = open_breaker(reset_timeout=0)
+    assert breaker.before_call() is True
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_successful_trial_closes_the_circuit():
+    breaker = open_breaker(reset_timeout=0)
+    breaker.before_call()
+    breaker.record()
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+
+def test_failed_trial_opens_the_circuit_again():
+    breaker = open_breaker(reset_timeout=0)
+    breaker.before_call()
+    breaker.reset_timeout = 30
+    breaker.record(transient_error())
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_cancelled_trial_frees_the_trial_slot(monkeypatch):
+    class HangingClient:
+        async def request(self, *args, **kwargs):
+            await asyncio.Event().wait()
+
+    monkeypatch.setattr(procurement, "get_http_client", lambda: HangingClient())
+    breaker = open_breaker(reset_timeout=0)
+    client = ProcurementClient("project", base_url="http://procurement.test", breaker=breaker)
+
+    async def cancel_trial():
+        task = asyncio.create_task(client.fetch_entitlement_details_async("ent-1"))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+
+
+def test_trial_cancelled_while_waiting_for_a_slot_frees_the_trial_slot():
+    breaker = open_breaker(reset_timeout=0)
+    client = ProcurementClient(
+        "project", base_url="http://procurement.test", breaker=breaker, max_concurrency=1
+    )
+
+    async def cancel_waiting_trial():
+        await client._async_semaphore.acquire()
+        task = asyncio.create_task(client.fetch_entitlement_details_async("ent-1"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiting_trial())
+    assert breaker.before_call() is True
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (sa_exc.OperationalError("UPDATE", {}, sqlite3.OperationalError("database is locked")), True),
+        (sa_exc.OperationalError("SELECT", {}, Exception("deadlock detected")), True),
+        (sa_exc.DBAPIError("SELECT", {}, Exception("server closed"), connection_invalidated=True), True),
+        (sa_exc.TimeoutError("QueuePool limit reached"), True),
+        (sa_exc.IntegrityError("INSERT", {}, sqlite3.IntegrityError("UNIQUE constraint failed")), False),
+        (sa_exc.DBAPIError("SELECT", {}, Exception("syntax error")), False),
+    ],
+    ids=["locked", "deadlock", "connection-invalidated", "pool-timeout", "integrity", "statement"],
+)
+def test_database_failures_are_transient_unless_the_statement_is_at_fault(error, transient):
+    assert is_transient(error) is transient
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.database import Base, get_async_db
+from app.events import EntitlementDetails
+from app.models import Account, OutboxTask, Subscription
+from app.routers import router
+
+SECRET = "internal-secret"
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    path = tmp_path / "accounts.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return f"sqlite+aiosqlite:///{path}"
+
+
+@pytest.fixture
+def session_factory(db_url):
+    # No pooling, the test and the app's client run on different event loops
+    engine = create_async_engine(db_url, poolclass=NullPool, connect_args={"timeout": 1})
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+@pytest.fixture
+def client(session_factory, monkeypatch):
+    monkeypatch.setattr(router, "SECRET_KEY", SECRET)
+
+    async def get_test_db():
+        async with session_factory() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(router.router)
+    app.dependency_overrides[get_async_db] = get_test_db
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def add(session_factory, *rows):
+    async def insert():
+        async with session_factory() as db:
+            db.add_all(rows)
+            await db.commit()
+
+    asyncio.run(insert())
+
+
+async def load(session_factory, model, **filters):
+    async with session_factory() as db:
+        return (await db.execute(model.__table__.select().filter_by(**filters))).one()
+
+
+@pytest.mark.parametrize("path", ["/internal/cache-stats", "/internal/db-pool", "/metrics"])
+def test_internal_endpoints_require_the_secret_header(client, path):
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={"x-internal-secret": "wrong"}).status_code == 401
+    assert client.get(path, headers={"x-internal-secret": SECRET}).status_code == 200
+
+
+def test_internal_endpoints_stay_closed_without_a_secret_key(client, monkeypatch):
+    monkeypatch.setattr(router, "SECRET_KEY", None)
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"x-internal-secret": ""}).status_code == 401
+    assert client.post("/accounts/acc-1/approve").status_code == 401
+
+
+def test_subscription_approval_holds_no_transaction_across_the_api_call(
+    client, session_factory, monkeypatch
+):
+    add(session_factory, Account(id=1, procurement_account_id="acc-1", status="active"))
+    add(session_factory, Subscription(account_id=1, subscription_id="ent-1", status="pending"))
+
+    async def fetch_entitlement_details_async(subscription_id):
+        return EntitlementDetails(
+            account="providers/p/accounts/acc-1",
+            plan="plan-1",
+            usage_reporting_id="usage-1",
+            create_time="2024-01-01T00:00:00Z",
+        )
+
+    approved = []
+
+    async def approve_entitlement_async(subscription_id):
+        # Writing elsewhere times out if the endpoint still holds SQLite's write lock
+        async with session_factory() as db:
+            await db.execute(
+                Subscription.__table__.update()
+                .where(Subscription.subscription_id == subscription_id)
+                .values(product_id="prod-1")
+            )
+            await db.commit()
+        row = await load(session_factory, Subscription, subscription_id=subscription_id)
+        approved.append((subscription_id, row.status))
+
+    monkeypatch.setattr(router, "fetch_entitlement_details_async", fetch_entitlement_details_async)
+    monkeypatch.setattr(router, "approve_entitlement_async", approve_entitlement_async)
+
+    headers = {"x-internal-secret": SECRET}
+    assert client.post("/subscriptions/ent-1/approve", headers=headers).status_code == 200
+    assert approved == [("ent-1", "pending")]
+    subscription = asyncio.run(load(session_factory, Subscription, subscription_id="ent-1"))
+    account = asyncio.run(load(session_factory, Account, procurement_account_id="acc-1"))
+    assert subscription.status == "active"
+    assert subscription.product_id == "prod-1"
+    assert account.plan_id == "plan-1"
+
+
+def signup_status(client, session_factory, account_status):
+    add(session_factory, Account(procurement_account_id="acc-1", status=account_status))
+    client.cookies.set(
+        router.SIGNUP_COOKIE, router.signup_status_token("acc-1"), path="/signup/acc-1"
+    )
+    response = client.get("/signup/acc-1/status")
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.parametrize(
+    "account_status, result",
+    [
+        ("pending", "pending"),
+        ("active", "approved"),
+        ("entitlement canceled", "failed"),
+    ],
+)
+def test_signup_status_is_final_for_every_state_but_pending(
+    client, session_factory, account_status, result
+):
+    status = signup_status(client, session_factory, account_status)
+    assert status["result"] == result
+    assert (status["reason"] is not None) == (result == "failed")
+
+
+def test_signup_status_fails_when_the_approval_task_gave_up(client, session_factory):
+    add(session_factory, OutboxTask(kind="approve_account", aggregate_id="acc-1", status="failed"))
+    status = signup_status(client, session_factory, "pending")
+    assert status["approval_status"] == "failed"
+    assert status["result"] == "failed"